@@ -1,11 +1,19 @@
-import pandas as pd
 import datetime as dt
-import yfinance as yf
+import pandas as pd
 import numpy as np
-import math
-import matplotlib.pyplot as plt
+import caching
 import supertrend
 import macd_analysis
+import market_data
+import trading_calendar
+import metrics
+import price_panel
+import trend_cache
+import visualize as viz
+
+# Price panels and universe analytics, keyed by ticker set and as-of date
+_panels = caching.LRUCache(maxsize=8)
+_analytics = caching.LRUCache(maxsize=256)
 
 def calculate_volatility(ticker:str, period='5y', visualize=False) -> float:
   """
@@ -13,7 +21,7 @@ def calculate_volatility(ticker:str, period='5y', visualize=False) -> float:
   """
 
   # Retrieve historical stock data
-  stock = yf.download(ticker, period=period)
+  stock = market_data.get_period(ticker, period)
 
   # We will perform our analysis using the Adjusted Closing price
   stock = stock['Adj Close']
@@ -25,74 +33,140 @@ def calculate_volatility(ticker:str, period='5y', visualize=False) -> float:
   stock_volatility = stock_volatility * 100
 
   if visualize:
-    str_vol = str(round(stock_volatility, 4))
+    viz.plot_volatility(ticker, stock_log_return, stock_volatility)
+  
+  return stock_volatility
 
-    fig, ax = plt.subplots()
-    stock_log_return.hist(ax=ax, bins=50, alpha=0.6, color='b')
-    ax.set_xlabel("Log return")
-    ax.set_ylabel("Freq of log return")
-    ax.set_title(ticker + " Volatility: " + str_vol + "%")
 
-    plt.show()
+def analyze_data(data : pd.DataFrame, visualize=False, constants=None, macd=(12, 26, 9)) -> pd.DataFrame:
+  """
+  Apply the adjusted Supertrend and the MACD analysis to a frame of historical bars and return
+  both readings side by side. constants are the supertrend (ATR period, multiplier) pairs and macd
+  the (fast, slow, signal) spans, both default to the strategy's standard parameters.
+  """
+
+  # Apply adjusted Supertrend Analysis
+  super_trend_res = supertrend.generate_trend(data, visualize, constants)
   
-  return stock_volatility
+  # Apply MACD Analysis
+  macd_res = macd_analysis.evaluate_MACD(data, visualize, *macd)
+
+  # Concatenate results
+  return pd.concat([super_trend_res, macd_res], axis=1)
 
+def signal_masks(trend_analysis : pd.DataFrame):
+  """
+  Boolean Series flagging the rows where either trend indicates that we should buy, and the rows
+  where either trend indicates that we should sell.
+  """
+
+  buy_mask = (trend_analysis['Trend'] == True) | (trend_analysis['Buy'] == True)
+  sell_mask = (trend_analysis['Trend'] == False) | (trend_analysis['Sell'] == True)
+
+  return buy_mask, sell_mask
 
-def parse_days(buy_signals : pd.DataFrame, sell_signals : pd.DataFrame):
+def panel_signals(panel : price_panel.PricePanel, constants=None, macd=(12, 26, 9)):
   """
-  Helper method to retrieve Numpy Arrays of the Buy and Sell Dates so they can be indexed properly
+  Evaluate the strategy for every ticker of a price_panel.PricePanel in one batched pass. Returns
+  dates x tickers boolean arrays of the supertrend reading and of the MACD buy and sell signals,
+  False where a ticker has no bar.
+  Tickers are batched by the days they have a bar on, so every ticker sees exactly the bars
+  analyze_data would see for it alone and the signals are identical. Usually the whole universe
+  forms one batch, recently listed or suspended tickers form their own.
   """
 
-  # Convert the indices to Pandas Series
-  buy_date_series = pd.Series(buy_signals.index.format(), dtype=pd.StringDtype())
-  sell_date_series = pd.Series(sell_signals.index.format(), dtype=pd.StringDtype())
+  if constants is None:
+    constants = supertrend.CONSTANTS
+
+  high, low, close = panel['High'], panel['Low'], panel['Close']
+  shape = close.shape
+  trend = np.zeros(shape, dtype=bool)
+  macd_buy = np.zeros(shape, dtype=bool)
+  macd_sell = np.zeros(shape, dtype=bool)
+
+  present = ~np.isnan(close)
+  batches = dict()
+  for j in range(shape[1]):
+    batches.setdefault(present[:, j].tobytes(), []).append(j)
+
+  for columns in batches.values():
+    rows = present[:, columns[0]]
+    if not rows.any():
+      continue
+
+    # The kernels compute in float64 whatever the panel stores
+    block = np.ix_(rows, columns)
+    sub_close = close[block].astype(float)
+    with metrics.stage('supertrend'):
+      readings = supertrend.supertrend_kernel(high[block], low[block], sub_close, constants)
+      combined, final_lower, final_upper = supertrend.combine_trends(*readings)
+    buy, sell = macd_analysis.evaluate_MACD_panel(pd.DataFrame(sub_close), *macd)
+
+    trend[block] = combined
+    macd_buy[block] = buy.values
+    macd_sell[block] = sell.values
+
+  return trend, macd_buy, macd_sell
+
+def panel_precision(panel : price_panel.PricePanel, constants=None, macd=(12, 26, 9)) -> dict:
+  """
+  Precision check of float32 panels: evaluate the strategy on a float64 panel and on its float32
+  copy and count the bars whose buy or sell signal differs.
+  float32 keeps about 7 significant digits, prices are rounded by at most 6e-8 of their value. A
+  signal can only flip on a bar where the close is that close to a supertrend band or the MACD line
+  that close to its signal line, so mismatches are rare, but they do happen over a large universe
+  and a flipped signal changes every later trade of its ticker. Use float32 panels for screening and
+  exploration and run the check on the data at hand before trusting float32 backtests.
+  """
 
-  # Convert to Numpy Arrays
-  buy_days = np.asarray(buy_date_series)
-  sell_days = np.asarray(sell_date_series)
+  reduced = panel.astype(np.float32)
+  present = ~np.isnan(panel['Close'])
+  bars = int(present.sum())
 
-  # Truncate dates to format 'YYYY-MM-DD'
-  for i in range(len(buy_days)):
-    buy_days[i] = buy_days[i][:10]
+  readings = []
+  for candidate in (panel, reduced):
+    trend, macd_buy, macd_sell = panel_signals(candidate, constants, macd)
+    readings.append(((trend | macd_buy) & present, (~trend | macd_sell) & present))
 
-  # Truncate dates to format 'YYYY-MM-DD'
-  for i in range(len(sell_days)):
-    sell_days[i] = sell_days[i][:10]
+  buy_mismatches = int((readings[0][0] != readings[1][0]).sum())
+  sell_mismatches = int((readings[0][1] != readings[1][1]).sum())
+  with np.errstate(invalid='ignore', divide='ignore'):
+    error = np.nanmax(np.abs(reduced.values.astype(float) - panel.values) / np.abs(panel.values)) if bars else 0.0
 
-  return buy_days, sell_days
+  return {'bars': bars, 'max_relative_price_error': float(error), 'buy_mismatches': buy_mismatches,
+          'sell_mismatches': sell_mismatches,
+          'mismatch_rate': (buy_mismatches + sell_mismatches) / (2*bars) if bars else 0.0,
+          'float64_bytes': panel.values.size * 8, 'float32_bytes': panel.values.size * 4}
 
-def evaluate_trends(ticker : str, start_date='2022-01-01', end_date=None, visualize=False):
+@metrics.timed('evaluate_trends')
+def evaluate_trends(ticker : str, start_date='2022-01-01', end_date=None, visualize=False, cache=True):
   """
   Perform market analysis on the givwn stock. This analysis will consist of analyzing two different types of
   trends.
   Generate a buy signal if either trend indicates to buy.
   Generate a sell signal if either trend indicates to sell.
+  The buy and sell days are returned as trading_calendar.DaySet objects supporting O(1) membership tests.
+  Unless cache is False the analysis is read from the on-disk trend_cache, which only analyses bars
+  that arrived since the last call.
   """
 
-  data = None
-  # Download historical stock data using the Yahoo Finance API
-  if end_date:
-    data = yf.download(ticker, start=start_date, end=end_date, period='1d', progress=False)
-  else:
-    data = yf.download(ticker, start=start_date, period='1d', progress=False)
+  metrics.count('tickers_evaluated')
 
-  # Apply adjusted Supertrend Analysis
-  super_trend_res = supertrend.generate_trend(data, visualize)
-  
-  # Apply MACD Analysis
-  macd_res = macd_analysis.evaluate_MACD(data, visualize)
-
-  # Concatenate results
-  trend_analysis = pd.concat([super_trend_res, macd_res], axis=1)
+  if cache and not visualize and trend_cache.enabled():
+    trend_analysis = trend_cache.get_trend_cache().trend_analysis(ticker, start_date, end_date)
+  else:
+    # Retrieve historical stock data from the market data provider
+    data = market_data.get_history(ticker, start=start_date, end=end_date)
 
-  # Find all rows where either trend indicates that we should be buying
-  buy_locs = trend_analysis.loc[(trend_analysis['Trend'] == True) | (trend_analysis['Buy'] == True)]
+    trend_analysis = analyze_data(data, visualize)
 
-  # Find all rows where either trend indicates that we should sell
-  sell_locs = trend_analysis.loc[(trend_analysis['Trend'] == False) | (trend_analysis['Sell'] == True)]
+  # Find all rows where either trend indicates that we should be buying or selling
+  buy_mask, sell_mask = signal_masks(trend_analysis)
 
-  # Reformat the dates
-  buy_days, sell_days = parse_days(buy_locs, sell_locs)
+  # Index the flagged days by trading calendar ordinal
+  calendar = trading_calendar.get_calendar('NYSE')
+  buy_days = trading_calendar.DaySet.from_dates(calendar, trend_analysis.index[buy_mask.values])
+  sell_days = trading_calendar.DaySet.from_dates(calendar, trend_analysis.index[sell_mask.values])
 
   # Return the analysis in case the client wishes to further use it and the list of buy and sell dates
   return trend_analysis, buy_days, sell_days
@@ -103,15 +177,74 @@ def calculate_high(ticker : str, period='5d') -> float:
   Determine the highest price of this stock within the given time period.
   """
 
-  stock = yf.download(ticker, period=period)
+  stock = market_data.get_period(ticker, period)
   stock = stock['Adj Close']
 
   return max(stock)
 
+def _as_of(as_of) -> pd.Timestamp:
+  return pd.Timestamp(as_of if as_of is not None else dt.date.today()).normalize()
+
+def close_panel(tickers : list[str], period : str, as_of=None) -> pd.DataFrame:
+  """
+  Dates x tickers frame of adjusted closes over a Yahoo Finance style period ending at as_of
+  (inclusive, today by default). Panels are shared: a cached panel of the same tickers and
+  as-of date reaching back far enough is sliced instead of fetching again.
+  """
+
+  as_of = _as_of(as_of)
+  start = market_data.period_start(period, as_of + pd.Timedelta(days=1))
+  key = (tuple(tickers), as_of)
+
+  cached = _panels.get(key)
+  if cached is None or cached[0] > start:
+    panel = market_data.get_panel(list(tickers), start=start, end=as_of + pd.Timedelta(days=1),
+                                  fields=('Adj Close',))['Adj Close']
+    cached = (start, panel)
+    _panels.set(key, cached)
+
+  panel = cached[1]
+  panel = panel.loc[panel.index >= start]
+
+  # A period of N days means each ticker's last N trading days
+  if period.endswith('d') and not period.endswith('ytd'):
+    remaining = panel.notna().values[::-1].cumsum(axis=0)[::-1]
+    panel = panel.where(remaining <= int(period[:-1]))
+
+  return panel
+
+def _memoized(name : str, tickers : list[str], period : str, as_of, compute) -> pd.Series:
+  key = (name, tuple(tickers), period, _as_of(as_of))
+  result = _analytics.get(key)
+  if result is None:
+    result = compute(close_panel(tickers, period, as_of))
+    _analytics.set(key, result)
+  return result.copy()
+
+def panel_volatility(tickers : list[str], period='5y', as_of=None) -> pd.Series:
+  """
+  Annualized volatility in percent of the daily log returns of every ticker, as calculate_volatility
+  computes it for one, from a single shared price panel. Results are memoized per
+  (ticker set, period, as-of date), the least recently used ones are evicted.
+  """
+
+  def compute(panel : pd.DataFrame) -> pd.Series:
+    # Returns between each ticker's consecutive bars, days without a bar are skipped
+    log_return = np.log(panel/panel.ffill().shift()).where(panel.notna())
+    return log_return.std() * np.sqrt(252) * 100
+
+  return _memoized('volatility', tickers, period, as_of, compute)
+
+def panel_high(tickers : list[str], period='5d', as_of=None) -> pd.Series:
+  """
+  Highest adjusted close of every ticker within the given period, as calculate_high computes it for
+  one, from a single shared price panel. Memoized like panel_volatility.
+  """
+  return _memoized('high', tickers, period, as_of, lambda panel: panel.max())
+
 def current_price(ticker : str) -> float:
   """
   Retrieve the current price of a stock
   """
 
-  stock = yf.Ticker(ticker)
-  return stock.info['currentPrice']
+  return market_data.get_quote_cache().prices([ticker])[ticker]
@@ -1,9 +1,14 @@
-import pandas_market_calendars as mcal
+import io
+import json
 import pandas as pd
 import numpy as np
 import simulator as sim
+import signals
+import ledger
+import performance
+import market_data
+import metrics
 import datetime
-import progressbar
 
 def get_backtest_tickers() -> list[str]:
   """
@@ -11,16 +16,99 @@ def get_backtest_tickers() -> list[str]:
   """
   return ['AAPL', '^GSPC', 'MSFT', 'AMZN']
 
-def backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12-31', tickers=None) -> str:
+def simulate(tickers : list[str], trading_days, balance : float, positions : dict, transaction_log : list[dict],
+             signal_matrix=None, progress=None, price_source=None) -> float:
   """
-  Backtest Trading Strategy on historical date range and ticker set of your choice
+  Execute the trading strategy on each market day of the given range and return the balance at the end.
+  Positions still open after the last day are left open.
   """
 
-  # Retrieve valid trading Days
+  for i, balance_after in simulate_days(tickers, trading_days, balance, positions, transaction_log, signal_matrix,
+                                        price_source):
+    balance = balance_after
+    if progress:
+      progress(i, len(trading_days) - 1)
+
+  return balance
+
+def simulate_days(tickers : list[str], trading_days, balance : float, positions : dict, transaction_log : list[dict],
+                  signal_matrix=None, price_source=None):
+  """
+  Execute the trading strategy one market day at a time, yielding the index of every simulated
+  trading day and the balance at its end.
+  """
+
+  # Note: We are operating under the guise that analysis is done directly prior to the market opening at 9am EST
+  # and we utilize the opening price on that day if we buy or sell
+  for i in range(1, len(trading_days)):
+    balance = sim.trading_day(tickers, trading_days[i], trading_days[i-1], positions, balance, transaction_log,
+                              backtest=True, signals=signal_matrix, price_source=price_source)
+    yield i, balance
+
+@metrics.timed('backtest')
+def run_backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12-31', tickers=None,
+                 engine='precompute', workers=1, progress=None, profile=False, dtype='float64') -> dict:
+  """
+  Backtest Trading Strategy on historical date range and ticker set of your choice and return the
+  results as structured data: the summary message, final balance, daily equity curve and risk metrics.
+  The 'precompute' engine runs the strategy once per ticker over the whole range and reads the
+  signals of each day from the resulting matrices, the 'daily' engine re-evaluates every ticker
+  on every trading day. The 'panel' engine computes the same matrices from one price panel of all
+  tickers (signals.compute_panel_signals), which workers share instead of each loading its own
+  tickers' histories, for universe scale runs; its dtype 'float32' halves the panel's memory.
+  With the precompute and panel engines, workers > 1 generates the signals of the tickers in a
+  process pool, portfolio allocation stays sequential.
+  progress is called as progress(tickers_done, tickers_total, 'signals') after every ticker of the
+  signal precompute and as progress(days_done, days_total) after every simulated day.
+  With profile=True the results include the time spent in each stage of this run and the number of
+  tickers and days processed, see metrics.profile. Work done in worker processes is not included.
+  """
+
+  if profile:
+    with metrics.profile() as run:
+      result = run_backtest(starting_balance, start_date, end_date, tickers, engine, workers, progress, dtype=dtype)
+    result['profile'] = run.summary()
+    return result
+
+  return backtest_portfolio(*prepare_backtest(starting_balance, start_date, end_date, tickers, engine, workers,
+                                              progress, dtype),
+                            progress)
+
+def signals_progress(progress):
+  """
+  Adapt a backtest progress callback to the per ticker progress of signals.compute_signals.
+  """
+
+  if progress is None:
+    return None
+  return lambda done, total: progress(done, total, 'signals')
+
+def backtest_days(start_date='2019-01-01', end_date='2020-12-31', engine='precompute', dtype='float64') -> np.ndarray:
+  """
+  Trading days of a backtest. Raises ValueError for an unknown engine or panel dtype or a range
+  without trading days, which is cheap to check before any data is read.
+  """
+
+  if engine not in ('precompute', 'panel', 'daily'):
+    raise ValueError('Unknown backtest engine: ' + engine)
+  if str(dtype) not in ('float32', 'float64'):
+    raise ValueError('Unknown panel dtype: ' + str(dtype))
+
   trading_days = sim.get_trading_days(start_date, end_date)
+  if len(trading_days) == 0:
+    raise ValueError('No trading days between ' + start_date + ' and ' + end_date)
+  return trading_days
 
-  bar = progressbar.ProgressBar(maxval=len(trading_days), \
-    widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+def prepare_backtest(starting_balance, start_date, end_date, tickers, engine, workers, progress=None,
+                     dtype='float64') -> tuple:
+  """
+  Everything a backtest of run_backtest's parameters reads: its tickers, trading days, starting
+  balance, signal matrix (None for the daily engine) and execution prices.
+  progress is reported during the signal precompute as in run_backtest.
+  """
+
+  # Retrieve valid trading Days
+  trading_days = backtest_days(start_date, end_date, engine, dtype)
 
   # Start with $100000
   if not starting_balance:
@@ -30,31 +118,50 @@ def backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12
 
   starting_balance = balance
 
-  # No Past Transactions and no Open Positions
-  transaction_log = []
-  positions = dict()
-
   # Retrieve Tickers we wish to use for this simulation
   if not tickers:
     tickers = get_backtest_tickers()
 
-  # Start up the progress bar
-  bar.start()
+  # Compute every signal of the backtest up front
+  if engine == 'precompute':
+    signal_matrix = signals.compute_signals(tickers, trading_days, workers=workers,
+                                            progress=signals_progress(progress))
+  elif engine == 'panel':
+    signal_matrix = signals.compute_panel_signals(tickers, trading_days, workers=workers, dtype=np.dtype(dtype),
+                                                  progress=signals_progress(progress))
+  else:
+    signal_matrix = None
+
+  # Read the opening prices of every ticker for the whole range at once
+  with metrics.stage('price_load'):
+    price_source = market_data.OpeningPrices(tickers, trading_days)
 
-  # Execute Trading Strategy on each market day of the specified date range
-  # Note: We are operating under the guise that analysis is done directly prior to the market opening at 9am EST
-  # and we utilize the opening price on that day if we buy or sell
-  for i in range(1, len(trading_days)):
-    balance = sim.trading_day(tickers, trading_days[i], trading_days[i-1], positions, balance, transaction_log, backtest=True)
-    bar.update(i)
+  return tickers, trading_days, starting_balance, signal_matrix, price_source
+
+def backtest_portfolio(tickers : list[str], trading_days, starting_balance : float, signal_matrix, price_source,
+                       progress=None, closes=None) -> dict:
+  """
+  Simulate one portfolio with signals and execution prices that have already been prepared, exit every
+  position after the last day and return the results described in run_backtest.
+  closes optionally is a dates x tickers frame of adjusted closes covering the trading days, used to
+  value the portfolio instead of reading the closes from the market data provider.
+  """
+
+  balance = starting_balance
+
+  # No Past Transactions and no Open Positions
+  transaction_log = ledger.Ledger()
+  positions = dict()
 
-  # Mark Progress as Finished
-  bar.finish()
+  # Execute Trading Strategy on each market day of the specified date range
+  with metrics.stage('simulation'):
+    balance = simulate(tickers, trading_days, balance, positions, transaction_log, signal_matrix, progress=progress,
+                       price_source=price_source)
 
   # Exit all current positions to see how well the simulation did
   #print('Holding Positions')
   #print(positions)
-  balance += sim.exit_all_positions(trading_days[-1], positions, transaction_log, backtest=True)
+  balance += sim.exit_all_positions(trading_days[-1], positions, transaction_log, backtest=True, price_source=price_source)
 
   result_msg = ''.join(['Invested $', str(starting_balance), ' and ended up with $', 
   str(balance), 
@@ -62,11 +169,265 @@ def backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12
   str(int(((balance - starting_balance)/starting_balance)*100)),
   '%'])
 
-  #print(result_msg)
-  #print(transaction_log)
+  # Value the portfolio at every close to get the equity curve and its risk metrics
+  prices = None
+  if closes is not None:
+    index = pd.DatetimeIndex(np.asarray(trading_days, dtype='datetime64[D]'))
+    prices = closes.reindex(index=index, columns=transaction_log.tickers).values
+  with metrics.stage('performance'):
+    curve = performance.equity_curve(transaction_log, trading_days, starting_balance, prices)
+
+  return {
+    'summary': result_msg,
+    'starting_balance': starting_balance,
+    'final_balance': balance,
+    'return_pct': (balance - starting_balance)/starting_balance*100,
+    'trades': len(transaction_log),
+    'metrics': performance.risk_metrics(curve),
+    'equity_curve': {
+      'dates': list(trading_days),
+      'equity': curve['equity'].tolist(),
+      'cash': curve['cash'].tolist(),
+      'drawdown': curve['drawdown'].tolist(),
+    },
+  }
+
+@metrics.timed('backtest_batch')
+def run_backtest_batch(portfolios : list[dict], workers=1, progress=None) -> list[dict]:
+  """
+  Backtest many portfolios against shared data and return the results of each, as run_backtest
+  would, in order. Portfolios are dicts of run_backtest parameters (tickers, starting_balance,
+  start_date, end_date), missing ones take run_backtest's defaults.
+  The signals of the union of all tickers are computed once over the union of all date ranges, and
+  the opening and closing prices are read once, then every portfolio is simulated against them.
+  Signals only depend on the LOOKBACK_YEARS of history before each day, so they are the ones the
+  precompute engine finds for a single portfolio.
+  progress is called as progress(tickers_done, tickers_total, 'signals') during the signal precompute
+  and as progress(days_done, days_total) over the days of all portfolios.
+  """
+
+  specs = []
+  for portfolio in portfolios:
+    spec = {
+      'tickers': portfolio.get('tickers') or get_backtest_tickers(),
+      'starting_balance': portfolio.get('starting_balance') or 100000,
+      'start_date': portfolio.get('start_date') or '2019-01-01',
+      'end_date': portfolio.get('end_date') or '2020-12-31',
+    }
+    spec['trading_days'] = sim.get_trading_days(spec['start_date'], spec['end_date'])
+    if len(spec['trading_days']) == 0:
+      raise ValueError('No trading days between ' + spec['start_date'] + ' and ' + spec['end_date'])
+    specs.append(spec)
+
+  if not specs:
+    return []
+
+  # Union of the tickers, in order of first appearance, and of the date ranges
+  tickers = list(dict.fromkeys(ticker for spec in specs for ticker in spec['tickers']))
+  trading_days = sim.get_trading_days(min(spec['trading_days'][0] for spec in specs),
+                                      max(spec['trading_days'][-1] for spec in specs))
+
+  # Shared signals and prices
+  signal_matrix = signals.compute_signals(tickers, trading_days, workers=workers, progress=signals_progress(progress))
+  with metrics.stage('price_load'):
+    price_source = market_data.OpeningPrices(tickers, trading_days)
+    index = pd.DatetimeIndex(np.asarray(trading_days, dtype='datetime64[D]'))
+    closes = pd.DataFrame(performance.price_matrix(tickers, trading_days), index=index, columns=tickers)
+
+  # Report the progress of each portfolio as part of the whole batch
+  total = sum(len(spec['trading_days']) - 1 for spec in specs)
+  offset = 0
+  results = []
+  for spec in specs:
+    portfolio_progress = None
+    if progress:
+      portfolio_progress = lambda done, days, offset=offset: progress(offset + done, total)
+
+    results.append(backtest_portfolio(spec['tickers'], spec['trading_days'], spec['starting_balance'], signal_matrix,
+                                      price_source, portfolio_progress, closes))
+    offset += len(spec['trading_days']) - 1
+
+  return results
+
+def stream_backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12-31', tickers=None,
+                    engine='precompute', workers=1, chunk_days=20, dtype='float64'):
+  """
+  Run a backtest like run_backtest and yield its output while it runs, in lists of the events of up
+  to chunk_days trading days:
+    {'type': 'trade', 'kind': 'buy' or 'sale', ...}  every transaction, in the JSON shape of the
+                                                       simulator's transaction logs
+    {'type': 'day', 'date', 'cash', 'equity', 'positions': {ticker: shares}}  the state at every close
+    {'type': 'summary', ...}  last, run_backtest's results without the equity curve
+  Transactions are dropped once they are yielded, so memory does not grow with the length of the
+  backtest. The day events follow performance.equity_curve, the summary equals run_backtest's up
+  to floating point rounding of the equity.
+  Parameters are only checked once iteration starts, callers answering a request check them first
+  with backtest_days.
+  """
+
+  tickers, trading_days, starting_balance, signal_matrix, price_source = \
+    prepare_backtest(starting_balance, start_date, end_date, tickers, engine, workers, dtype=dtype)
+  with metrics.stage('price_load'):
+    closes = performance.price_matrix(tickers, trading_days)
+
+  # Intern every ticker up front so ledger ids are columns of the closes
+  transaction_log = ledger.Ledger()
+  for ticker in tickers:
+    transaction_log.ticker_id(ticker)
+  positions = dict()
+
+  holdings = np.zeros(len(tickers), dtype=np.int64)
+  trades = 0
+  cash_flow = 0.0
+  equity = []
+  chunk = []
+
+  def close_day(i : int) -> dict:
+    nonlocal trades, cash_flow
+
+    # Fold the day's transactions into the holdings and cash, like performance.holdings_matrix
+    records = transaction_log.records
+    is_buy = records['kind'] == ledger.BUY
+    np.add.at(holdings, records['ticker'], np.where(is_buy, records['amount'], -records['amount']))
+    flows = np.where(is_buy, -records['amount']*records['buy_price'], records['amount']*records['sell_price'])
+    cash_flow += np.cumsum(flows)[-1] if len(flows) else 0.0
+
+    kinds = ['buy' if kind == ledger.BUY else 'sale' for kind in records['kind'].tolist()]
+    chunk.extend({'type': 'trade', 'kind': kind, **log} for kind, log in zip(kinds, transaction_log.to_dicts()))
+    trades += len(records)
+    transaction_log.clear()
+
+    cash = starting_balance + cash_flow
+    invested = np.where(holdings != 0, holdings*np.nan_to_num(closes[i]), 0.0).sum()
+    equity.append(cash + invested)
+
+    held = np.flatnonzero(holdings)
+    return {'type': 'day', 'date': str(trading_days[i]), 'cash': float(cash), 'equity': float(cash + invested),
+            'positions': {tickers[j]: int(holdings[j]) for j in held}}
+
+  chunk.append(close_day(0))
+  balance = starting_balance
+
+  with metrics.stage('simulation'):
+    for i, balance in simulate_days(tickers, trading_days, balance, positions, transaction_log, signal_matrix,
+                                    price_source):
+      # The last day is closed once every position has been exited
+      if i < len(trading_days) - 1:
+        chunk.append(close_day(i))
+      if i % chunk_days == 0 and chunk:
+        yield chunk
+        chunk = []
+
+  balance += sim.exit_all_positions(trading_days[-1], positions, transaction_log, backtest=True,
+                                    price_source=price_source)
+  if len(trading_days) > 1:
+    chunk.append(close_day(len(trading_days) - 1))
+
+  equity = np.array(equity)
+  curve = pd.DataFrame({'equity': equity, 'drawdown': equity/np.maximum.accumulate(equity) - 1})
+  chunk.append({
+    'type': 'summary',
+    'summary': ''.join(['Invested $', str(starting_balance), ' and ended up with $', str(balance),
+                        '. This is a profit of ', str(int(((balance - starting_balance)/starting_balance)*100)), '%']),
+    'starting_balance': starting_balance,
+    'final_balance': balance,
+    'return_pct': (balance - starting_balance)/starting_balance*100,
+    'trades': trades,
+    'metrics': performance.risk_metrics(curve),
+  })
+  yield chunk
+
+def ndjson_stream(chunks):
+  """
+  Encode the event chunks of stream_backtest as newline delimited JSON, one bytes object per chunk.
+  """
+
+  for chunk in chunks:
+    yield ''.join(json.dumps(event, default=float) + '\n' for event in chunk).encode()
+
+# Columns of the Arrow encoding, one row per trade, per day ('balance'), per position held at a
+# close ('position') and a last 'summary' row carrying the summary as JSON
+ARROW_COLUMNS = ('type', 'date', 'ticker', 'amount', 'buy_price', 'sell_price', 'cash', 'equity', 'summary')
+
+def arrow_stream(chunks):
+  """
+  Encode the event chunks of stream_backtest as an Arrow IPC stream, one record batch per chunk.
+  Requires pyarrow.
+  """
+
+  import pyarrow as pa
+
+  schema = pa.schema([('type', pa.string()), ('date', pa.date32()), ('ticker', pa.string()), ('amount', pa.int64()),
+                      ('buy_price', pa.float64()), ('sell_price', pa.float64()), ('cash', pa.float64()),
+                      ('equity', pa.float64()), ('summary', pa.string())])
+
+  sink = io.BytesIO()
+  writer = pa.ipc.new_stream(sink, schema)
+
+  def drain() -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+  for chunk in chunks:
+    rows = []
+    for event in chunk:
+      if event['type'] == 'trade':
+        rows.append({'type': event['kind'], 'date': event['date'], 'ticker': event['ticker'], 'amount': event['amount'],
+                     'buy_price': event['buy_price'], 'sell_price': event.get('sell_price')})
+      elif event['type'] == 'day':
+        rows.append({'type': 'balance', 'date': event['date'], 'cash': event['cash'], 'equity': event['equity']})
+        rows.extend({'type': 'position', 'date': event['date'], 'ticker': ticker, 'amount': amount}
+                    for ticker, amount in event['positions'].items())
+      else:
+        rows.append({'type': 'summary', 'cash': event['final_balance'], 'summary': json.dumps(event, default=float)})
+
+    columns = {column: [row.get(column) for row in rows] for column in ARROW_COLUMNS}
+    columns['date'] = [datetime.date.fromisoformat(date) if date is not None else None for date in columns['date']]
+    writer.write_batch(pa.record_batch([pa.array(columns[field.name], type=field.type) for field in schema],
+                                       schema=schema))
+    yield drain()
+
+  writer.close()
+  yield drain()
+
+def backtest(starting_balance=100000, start_date='2019-01-01', end_date='2020-12-31', tickers=None,
+             engine='precompute', workers=1, progress=None, dtype='float64') -> str:
+  """
+  Backtest Trading Strategy on historical date range and ticker set of your choice and return a
+  summary message. See run_backtest for the parameters and the full results.
+  """
+
+  return run_backtest(starting_balance, start_date, end_date, tickers, engine, workers, progress, dtype=dtype)['summary']
+
+
+class TerminalProgress:
+  """
+  Progress callback drawing a progress bar in the terminal, a new one for every stage of the run.
+  """
+
+  def __init__(self):
+    self.bar = None
+    self.stage = None
+    self.total = None
+
+  def __call__(self, done : int, total : int, stage='simulation'):
+    import progressbar
+
+    # Start up the progress bar
+    if self.bar is None or stage != self.stage or total != self.total:
+      self.stage, self.total = stage, total
+      self.bar = progressbar.ProgressBar(maxval=total, \
+        widgets=[stage.ljust(11), progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+      self.bar.start()
+
+    self.bar.update(done)
 
-  return result_msg
+    # Mark Progress as Finished
+    if done == total:
+      self.bar.finish()
 
 
 if __name__ == "__main__":
-  backtest()
+  print(backtest(progress=TerminalProgress()))
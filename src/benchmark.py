@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import market_data
+import synthetic
+import supertrend
+import macd_analysis
+import analysis
+import simulator as sim
+import backtesting
+import trend_cache
+
+TICKER_COUNTS = (4, 50, 500)
+YEAR_COUNTS = (1, 5, 20)
+
+# Last day of every benchmark range, histories are generated back from here
+END_DATE = '2024-12-31'
+
+# Runs longer than this are not repeated
+MAX_REPEAT_SECONDS = 10.0
+
+# Modules whose import is timed in a fresh interpreter, main being the API's cold start
+STARTUP_MODULES = ('main', 'backtesting')
+
+# Optional dependencies that must only be imported once a request needs them
+HEAVY_MODULES = ('matplotlib', 'yfinance', 'pandas_market_calendars', 'progressbar')
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_date(years : int) -> str:
+  return str((pd.Timestamp(END_DATE) - pd.DateOffset(years=years)).date())
+
+def import_module(module : str):
+  """
+  Import a module of this package in a fresh interpreter, so nothing is cached from earlier imports.
+  """
+  subprocess.run([sys.executable, '-c', 'import ' + module], cwd=SOURCE_DIR, check=True)
+
+def eager_imports(module='main') -> list[str]:
+  """
+  The HEAVY_MODULES that importing a module pulls in, these should be loaded lazily.
+  """
+
+  code = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))' % (module, HEAVY_MODULES)
+  output = subprocess.run([sys.executable, '-c', code], cwd=SOURCE_DIR, check=True, capture_output=True, text=True)
+  return output.stdout.split()
+
+def cases(ticker_counts=TICKER_COUNTS, year_counts=YEAR_COUNTS, cache=None) -> dict:
+  """
+  Benchmark cases by name. Each case is a function performing one timed run. Every case computes
+  from scratch, except the trend_cache cases added for a trend_cache.TrendCache passed as cache,
+  which time reading the analysis back from it.
+  """
+
+  provider = market_data.get_provider()
+  calendar_end = str(pd.Timestamp(END_DATE) + pd.Timedelta(days=1))
+  selected = dict()
+
+  # Interpreter start up plus import, the interpreter alone is timed as a reference
+  selected['startup.python'] = lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True)
+  for module in STARTUP_MODULES:
+    selected['startup.import/%s' % module] = lambda module=module: import_module(module)
+
+  for years in year_counts:
+    data = provider.history('SYN000', start=start_date(years), end=calendar_end)
+    selected['supertrend.generate_trend/years=%d' % years] = lambda data=data: supertrend.generate_trend(data)
+    selected['macd_analysis.evaluate_MACD/years=%d' % years] = lambda data=data: macd_analysis.evaluate_MACD(data)
+    selected['analysis.evaluate_trends/years=%d' % years] = \
+      lambda years=years: analysis.evaluate_trends('SYN000', start_date=start_date(years), end_date=calendar_end)
+    if cache is not None:
+      selected['trend_cache.trend_analysis/cached/years=%d' % years] = \
+        lambda years=years: cache.trend_analysis('SYN000', start_date(years), calendar_end)
+
+  days = sim.get_trading_days(start_date(1), END_DATE)
+  for tickers in ticker_counts:
+    names = synthetic.universe(tickers)
+    selected['simulator.trading_day/tickers=%d' % tickers] = \
+      lambda names=names: sim.trading_day(names, days[-1], days[-2], dict(), 100000, [], backtest=True)
+
+  for tickers in ticker_counts:
+    for years in year_counts:
+      names = synthetic.universe(tickers)
+      selected['backtesting.backtest/tickers=%d/years=%d' % (tickers, years)] = \
+        lambda names=names, years=years: backtesting.backtest(100000, start_date(years), END_DATE, names)
+
+  return selected
+
+def time_case(fn, repeat : int) -> dict:
+  """
+  Time a case after one warm up run. Returns the median and minimum over the timed runs.
+  """
+
+  start = time.perf_counter()
+  fn()
+  warm_up = time.perf_counter() - start
+
+  timings = []
+  for _ in range(repeat if warm_up < MAX_REPEAT_SECONDS else 1):
+    start = time.perf_counter()
+    fn()
+    timings.append(time.perf_counter() - start)
+
+  return {'median': statistics.median(timings), 'min': min(timings), 'runs': len(timings)}
+
+def run(ticker_counts=TICKER_COUNTS, year_counts=YEAR_COUNTS, repeat=3, only=None, log=sys.stderr) -> dict:
+  """
+  Run the benchmark suite against synthetic data and return the results in baseline format.
+  only optionally restricts the run to cases whose name contains one of the given strings.
+  The trend cache is off, so repeated runs measure the computation and the user's cache directory
+  is left alone. The cached cases use a temporary one.
+  """
+
+  market_data.set_provider(synthetic.SyntheticProvider())
+
+  results = dict()
+  with tempfile.TemporaryDirectory() as cache_dir, trend_cache.disabled():
+    for name, fn in cases(ticker_counts, year_counts, trend_cache.TrendCache(cache_dir)).items():
+      if only and not any(part in name for part in only):
+        continue
+      results[name] = time_case(fn, repeat)
+      if log:
+        print('%-50s %9.4fs' % (name, results[name]['median']), file=log)
+
+  return {
+    'environment': {
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'pandas': pd.__version__,
+      'machine': platform.machine(),
+      'processor': platform.processor(),
+    },
+    'results': results,
+    'eager_imports': eager_imports(),
+  }
+
+def compare(baseline : dict, current : dict, threshold=0.2) -> list[dict]:
+  """
+  Compare two runs case by case. A case regresses when its median time grew by more than threshold
+  (a fraction) over the baseline.
+  """
+
+  rows = []
+  for name, result in current['results'].items():
+    reference = baseline['results'].get(name)
+    if reference is None:
+      continue
+    ratio = result['median']/reference['median'] if reference['median'] else float('inf')
+    rows.append({'case': name, 'baseline': reference['median'], 'current': result['median'], 'ratio': ratio,
+                 'regression': ratio > 1 + threshold})
+  return rows
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark the strategy on seeded synthetic market data.')
+  parser.add_argument('mode', choices=['run', 'compare'])
+  parser.add_argument('baseline', help='JSON file to write (run) or to compare against (compare)')
+  parser.add_argument('--tickers', type=int, nargs='+', default=list(TICKER_COUNTS))
+  parser.add_argument('--years', type=int, nargs='+', default=list(YEAR_COUNTS))
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--only', nargs='+', default=None, help='Only run cases whose name contains one of these')
+  parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before flagging, as a fraction')
+  args = parser.parse_args()
+
+  current = run(args.tickers, args.years, args.repeat, args.only)
+
+  if args.mode == 'run':
+    with open(args.baseline, 'w') as f:
+      json.dump(current, f, indent=2)
+  else:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for row in rows:
+      print('%-50s %9.4fs -> %9.4fs  %5.2fx %s' % (row['case'], row['baseline'], row['current'], row['ratio'],
+                                                  'REGRESSION' if row['regression'] else ''))
+
+    # Heavy dependencies imported at start up count as a regression on their own
+    if current['eager_imports']:
+      print('main imports ' + ', '.join(current['eager_imports']) + ' at start up: REGRESSION')
+    sys.exit(1 if any(row['regression'] for row in rows) or current['eager_imports'] else 0)
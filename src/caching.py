@@ -0,0 +1,105 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+  """
+  Thread safe key/value cache whose entries expire ttl seconds after they were stored.
+  """
+
+  def __init__(self, ttl : float, clock=time.monotonic):
+    self.ttl = ttl
+    self.clock = clock
+    self._entries = dict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return default
+      value, expires = entry
+      if expires <= self.clock():
+        del self._entries[key]
+        return default
+      return value
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries[key] = (value, self.clock() + self.ttl)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+
+class LRUCache:
+  """
+  Thread safe key/value cache holding at most maxsize entries. Storing a new entry into a full cache
+  evicts the least recently used one.
+  """
+
+  def __init__(self, maxsize=128):
+    self.maxsize = maxsize
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      if key not in self._entries:
+        return default
+      self._entries.move_to_end(key)
+      return self._entries[key]
+
+  def set(self, key, value):
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+
+class SingleFlight:
+  """
+  Runs a computation at most once at a time per key. Callers asking for a key whose computation is
+  already running wait for it and share its result (or exception) instead of running it again.
+  Nothing is kept once the computation finishes, pair it with a cache to reuse results.
+  """
+
+  def __init__(self):
+    self._calls = dict()
+    self._lock = threading.Lock()
+
+  def do(self, key, fn):
+    with self._lock:
+      future = self._calls.get(key)
+      leader = future is None
+      if leader:
+        future = Future()
+        self._calls[key] = future
+
+    if leader:
+      try:
+        future.set_result(fn())
+      except Exception as e:
+        future.set_exception(e)
+      finally:
+        with self._lock:
+          del self._calls[key]
+
+    return future.result()
+
+  def __len__(self) -> int:
+    return len(self._calls)
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pytest
+import market_data
+import synthetic
+import supertrend
+import macd_analysis
+import indicators
+import analysis
+import signals
+import simulator as sim
+import backtesting
+
+TICKERS = synthetic.universe(4)
+
+
+@pytest.fixture(autouse=True)
+def synthetic_data(monkeypatch):
+  """
+  Serve synthetic bars and keep the on-disk trend cache out of the comparisons.
+  """
+
+  monkeypatch.setenv('ROBOTRADER_TREND_CACHE', '0')
+  previous = market_data.get_provider()
+  market_data.set_provider(synthetic.SyntheticProvider())
+  yield
+  market_data.set_provider(previous)
+
+def bars(ticker='SYN000', start='2018-01-01', end='2021-01-01') -> pd.DataFrame:
+  return market_data.get_history(ticker, start=start, end=end)
+
+def assert_identical(actual, expected):
+  np.testing.assert_array_equal(np.asarray(actual), np.asarray(expected))
+
+# The supertrend loop the kernel replaced
+def reference_supertrend(data, atr_period, atr_multiplier):
+
+  high, low, close = data['High'], data['Low'], data['Close'].values
+  HF = supertrend.calc_HF(high, low)
+  ATR = supertrend.calc_ATR(high, low, data['Close'], atr_period)
+  final_upper_band = (HF + (atr_multiplier*ATR)).values
+  final_lower_band = (HF - (atr_multiplier*ATR)).values
+  trend = [True] * len(data)
+
+  for i in range(1, len(data)):
+    if close[i] > final_upper_band[i-1]:
+      trend[i] = True
+    elif close[i] < final_lower_band[i-1]:
+      trend[i] = False
+    else:
+      trend[i] = trend[i-1]
+      if trend[i] and final_lower_band[i] < final_lower_band[i-1]:
+        final_lower_band[i] = final_lower_band[i-1]
+      if not trend[i] and final_upper_band[i] > final_upper_band[i-1]:
+        final_upper_band[i] = final_upper_band[i-1]
+
+    if trend[i]:
+      final_upper_band[i] = np.nan
+    else:
+      final_lower_band[i] = np.nan
+
+  return np.array(trend), final_lower_band, final_upper_band
+
+# The crossover loop of evaluate_MACD that crossovers replaced
+def reference_crossovers(MACD_list, signal_list):
+
+  buy_signal = [False] * len(MACD_list)
+  sell_signal = [False] * len(MACD_list)
+  macd, signal, prev = 1, 2, -1
+
+  for i in range(len(MACD_list)):
+    greater = macd if MACD_list[i] >= signal_list[i] else signal
+    if greater != prev:
+      if prev != -1 and prev == signal and MACD_list[i] < 0:
+        buy_signal[i] = True
+      elif prev != -1 and prev == macd and MACD_list[i] > 0:
+        sell_signal[i] = True
+    prev = greater
+
+  return buy_signal, sell_signal
+
+def test_kernel_matches_reference_loop():
+  frames = [bars(ticker) for ticker in TICKERS]
+  high, low, close = (np.column_stack([data[field].values for data in frames]) for field in ('High', 'Low', 'Close'))
+
+  trend, lower, upper = supertrend.supertrend_kernel(high, low, close, supertrend.CONSTANTS)
+
+  for j, (atr_period, atr_multiplier) in enumerate(supertrend.CONSTANTS):
+    for k, data in enumerate(frames):
+      expected = reference_supertrend(data, atr_period, atr_multiplier)
+      assert_identical(trend[:, j, k], expected[0])
+      assert_identical(lower[:, j, k], expected[1])
+      assert_identical(upper[:, j, k], expected[2])
+
+def test_crossovers_match_reference_loop():
+  for ticker in TICKERS:
+    MACD_line, signal_line, _ = macd_analysis.MACD(bars(ticker)['Close'])
+    buy, sell = macd_analysis.crossovers(MACD_line.values, signal_line.values)
+    expected_buy, expected_sell = reference_crossovers(MACD_line.tolist(), signal_line.tolist())
+    assert_identical(buy, expected_buy)
+    assert_identical(sell, expected_sell)
+
+def test_strategy_state_matches_analyze_data():
+  data = bars()
+  expected = analysis.analyze_data(data)
+
+  state = indicators.StrategyState()
+  rows = [state.update(str(date.date()), high, low, close)
+          for date, high, low, close in zip(data.index, data['High'], data['Low'], data['Close'])]
+  actual = pd.DataFrame(rows, index=data.index)
+
+  for column in actual.columns:
+    assert_identical(actual[column].values.astype(expected[column].dtype), expected[column].values)
+
+def test_precompute_engine_matches_daily_engine():
+  kwargs = dict(tickers=TICKERS, start_date='2020-01-01', end_date='2020-04-30')
+  precompute = backtesting.run_backtest(engine='precompute', **kwargs)
+  daily = backtesting.run_backtest(engine='daily', **kwargs)
+
+  assert precompute['final_balance'] == daily['final_balance']
+  assert precompute['trades'] == daily['trades']
+  assert precompute['equity_curve'] == daily['equity_curve']
+
+def test_panel_signals_match_per_ticker_signals():
+  trading_days = sim.get_trading_days('2020-01-01', '2020-12-31')
+  expected = signals.compute_signals(TICKERS, trading_days)
+  actual = signals.compute_panel_signals(TICKERS, trading_days)
+
+  assert_identical(actual.buy, expected.buy)
+  assert_identical(actual.sell, expected.sell)
+
+def test_panel_engine_matches_precompute_engine():
+  kwargs = dict(tickers=TICKERS, start_date='2020-01-01', end_date='2020-04-30')
+  precompute = backtesting.run_backtest(engine='precompute', **kwargs)
+  panel = backtesting.run_backtest(engine='panel', **kwargs)
+
+  assert panel['final_balance'] == precompute['final_balance']
+  assert panel['equity_curve'] == precompute['equity_curve']
@@ -0,0 +1,285 @@
+import math
+
+# Streaming versions of the indicators in supertrend.py and macd_analysis.py. Every state object is
+# advanced one bar at a time in O(1) and reproduces the batch functions value for value, so a
+# ticker's state can be persisted (to_dict/from_dict) and advanced by only the newest bars.
+
+def _fmax(a : float, b : float) -> float:
+  """
+  Maximum of two floats ignoring NaN, like numpy.fmax.
+  """
+
+  if a != a:
+    return b
+  if b != b:
+    return a
+  return a if a >= b else b
+
+
+class EMAState:
+  """
+  Exponentially weighted mean of a series, following the recursion pandas' ewm().mean() uses so
+  results agree to the last bit.
+  """
+
+  def __init__(self, com : float, adjust=True, min_periods=0):
+    self.com = com
+    self.adjust = adjust
+    self.min_periods = max(int(min_periods), 1)
+    self.weighted = math.nan
+    self.old_wt = 1.
+    self.nobs = 0
+    self.count = 0
+
+  @classmethod
+  def from_span(cls, span : float, adjust=True, min_periods=0):
+    return cls((span - 1) / 2, adjust, min_periods)
+
+  @classmethod
+  def from_alpha(cls, alpha : float, adjust=True, min_periods=0):
+    return cls(1 / alpha - 1, adjust, min_periods)
+
+  def update(self, cur : float) -> float:
+    """
+    Fold in the next value and return the mean up to and including it.
+    """
+
+    cur = float(cur)
+    alpha = 1. / (1. + self.com)
+    new_wt = 1. if self.adjust else alpha
+    is_observation = cur == cur
+    self.nobs += is_observation
+
+    if self.count == 0:
+      self.weighted = cur
+    elif self.weighted == self.weighted:
+      if is_observation:
+        self.old_wt *= 1. - alpha
+        # Skipping equal values avoids rounding drift on constant series
+        if self.weighted != cur:
+          self.weighted = (self.old_wt * self.weighted + new_wt * cur) / (self.old_wt + new_wt)
+        if self.adjust:
+          self.old_wt += new_wt
+        else:
+          self.old_wt = 1.
+      else:
+        self.old_wt *= 1. - alpha
+    elif is_observation:
+      self.weighted = cur
+
+    self.count += 1
+    return self.value
+
+  @property
+  def value(self) -> float:
+    return self.weighted if self.nobs >= self.min_periods else math.nan
+
+  def to_dict(self) -> dict:
+    return {'com': self.com, 'adjust': self.adjust, 'min_periods': self.min_periods,
+            'weighted': self.weighted, 'old_wt': self.old_wt, 'nobs': self.nobs, 'count': self.count}
+
+  @classmethod
+  def from_dict(cls, state : dict):
+    ema = cls(state['com'], state['adjust'], state['min_periods'])
+    ema.weighted, ema.old_wt = state['weighted'], state['old_wt']
+    ema.nobs, ema.count = state['nobs'], state['count']
+    return ema
+
+
+class MACDState:
+  """
+  MACD line, signal line and crossover signals of macd_analysis.evaluate_MACD, one close at a time.
+  """
+
+  def __init__(self, a=12, b=26, c=9):
+    self.fast = EMAState.from_span(a, adjust=False)
+    self.slow = EMAState.from_span(b, adjust=False)
+    self.signal = EMAState.from_span(c, adjust=False)
+    self.above = None
+
+  def update(self, close : float):
+    """
+    Fold in the next close, return (MACD, signal, buy, sell) for it.
+    """
+
+    MACD_line = self.fast.update(close) - self.slow.update(close)
+    signal_line = self.signal.update(MACD_line)
+
+    # Same crossover rule as macd_analysis.crossovers
+    above = MACD_line >= signal_line
+    crossed = self.above is not None and above != self.above
+    self.above = above
+
+    buy = crossed and above and MACD_line < 0
+    sell = crossed and not above and MACD_line > 0
+
+    return MACD_line, signal_line, buy, sell
+
+  def to_dict(self) -> dict:
+    return {'fast': self.fast.to_dict(), 'slow': self.slow.to_dict(), 'signal': self.signal.to_dict(),
+            'above': self.above}
+
+  @classmethod
+  def from_dict(cls, state : dict):
+    macd = cls.__new__(cls)
+    macd.fast = EMAState.from_dict(state['fast'])
+    macd.slow = EMAState.from_dict(state['slow'])
+    macd.signal = EMAState.from_dict(state['signal'])
+    macd.above = state['above']
+    return macd
+
+
+class ATRState:
+  """
+  Average True Range of supertrend.calc_ATR, one bar at a time.
+  """
+
+  def __init__(self, atr_period : int):
+    self.atr_period = atr_period
+    self.ema = EMAState.from_alpha(1/atr_period, adjust=True, min_periods=atr_period)
+    self.prev_close = math.nan
+
+  def update(self, high : float, low : float, close : float) -> float:
+    tr = _fmax(high - low, abs(high - self.prev_close))
+    tr = _fmax(tr, abs(low - self.prev_close))
+    self.prev_close = close
+    return self.ema.update(tr)
+
+  def to_dict(self) -> dict:
+    return {'atr_period': self.atr_period, 'ema': self.ema.to_dict(), 'prev_close': self.prev_close}
+
+  @classmethod
+  def from_dict(cls, state : dict):
+    atr = cls(state['atr_period'])
+    atr.ema = EMAState.from_dict(state['ema'])
+    atr.prev_close = state['prev_close']
+    return atr
+
+
+class SupertrendState:
+  """
+  Band and trend state of supertrend.supertrend for one (ATR period, multiplier) pair.
+  """
+
+  def __init__(self, atr_period : int, atr_multiplier : float):
+    self.atr_multiplier = atr_multiplier
+    self.atr = ATRState(atr_period)
+    self.trend = True
+    self.upper = math.nan
+    self.lower = math.nan
+    self.count = 0
+
+  def update(self, high : float, low : float, close : float):
+    """
+    Fold in the next bar, return (trend, lower band, upper band) for it.
+    """
+
+    HF = (high + low)/2
+    ATR = self.atr.update(high, low, close)
+    upper = HF + (self.atr_multiplier*ATR)
+    lower = HF - (self.atr_multiplier*ATR)
+
+    # The first bar starts an up trend and keeps both bands
+    if self.count > 0:
+      if close > self.upper:
+        self.trend = True
+      elif close < self.lower:
+        self.trend = False
+      else:
+        if self.trend and lower < self.lower:
+          lower = self.lower
+        if not self.trend and upper > self.upper:
+          upper = self.upper
+
+      if self.trend:
+        upper = math.nan
+      else:
+        lower = math.nan
+
+    self.upper, self.lower = upper, lower
+    self.count += 1
+    return self.trend, lower, upper
+
+  def to_dict(self) -> dict:
+    return {'atr_multiplier': self.atr_multiplier, 'atr': self.atr.to_dict(), 'trend': self.trend,
+            'upper': self.upper, 'lower': self.lower, 'count': self.count}
+
+  @classmethod
+  def from_dict(cls, state : dict):
+    st = cls.__new__(cls)
+    st.atr_multiplier = state['atr_multiplier']
+    st.atr = ATRState.from_dict(state['atr'])
+    st.trend, st.upper, st.lower = state['trend'], state['upper'], state['lower']
+    st.count = state['count']
+    return st
+
+
+def _band_mean(bands : list[float]) -> float:
+  """
+  Mean of the bands that are set, summed in order like supertrend.combine_trends.
+  """
+
+  valid = [band for band in bands if band == band]
+  if not valid:
+    return math.nan
+  total = valid[0]
+  for band in valid[1:]:
+    total += band
+  return total / len(valid)
+
+
+# Supertrend (ATR period, multiplier) pairs and MACD spans of the strategy
+STRATEGY_PARAMS = (((12, 3), (10, 1), (11, 2)), (12, 26, 9))
+
+
+class StrategyState:
+  """
+  Full strategy of analysis.evaluate_trends for one ticker: the combined supertrends of
+  supertrend.generate_trend plus MACD. Tracks the date of the last bar folded in and the signals
+  it produced.
+  """
+
+  def __init__(self, constants=STRATEGY_PARAMS[0], macd=STRATEGY_PARAMS[1]):
+    self.supertrends = [SupertrendState(atr_period, atr_multiplier) for atr_period, atr_multiplier in constants]
+    self.macd = MACDState(*macd)
+    self.last_date = None
+    self.buy = False
+    self.sell = False
+
+  def update(self, date : str, high : float, low : float, close : float) -> dict:
+    """
+    Fold in the bar of the given date and return its row of the trend analysis.
+    """
+
+    high, low, close = float(high), float(low), float(close)
+    readings = [st.update(high, low, close) for st in self.supertrends]
+    trend = all(reading[0] for reading in readings)
+    lower = _band_mean([reading[1] for reading in readings])
+    upper = _band_mean([reading[2] for reading in readings])
+    if trend:
+      upper = math.nan
+    else:
+      lower = math.nan
+
+    MACD_line, signal_line, macd_buy, macd_sell = self.macd.update(close)
+
+    # Buy if either trend indicates to buy, sell if either indicates to sell
+    self.buy = trend or macd_buy
+    self.sell = not trend or macd_sell
+    self.last_date = date
+
+    return {'Trend': trend, 'Final Lower Band': lower, 'Final Upper Band': upper,
+            'MACD': MACD_line, 'Signal': signal_line, 'Buy': macd_buy, 'Sell': macd_sell}
+
+  def to_dict(self) -> dict:
+    return {'supertrends': [st.to_dict() for st in self.supertrends], 'macd': self.macd.to_dict(),
+            'last_date': self.last_date, 'buy': self.buy, 'sell': self.sell}
+
+  @classmethod
+  def from_dict(cls, state : dict):
+    strategy = cls.__new__(cls)
+    strategy.supertrends = [SupertrendState.from_dict(st) for st in state['supertrends']]
+    strategy.macd = MACDState.from_dict(state['macd'])
+    strategy.last_date = state['last_date']
+    strategy.buy, strategy.sell = state['buy'], state['sell']
+    return strategy
@@ -0,0 +1,119 @@
+import argparse
+import pandas as pd
+import market_data
+import indicators
+import metrics
+import trend_cache
+
+# Columns of analysis.analyze_data, the rows every chunk is returned with
+ANALYSIS_COLUMNS = trend_cache.ANALYSIS_COLUMNS
+
+# Calendar days per chunk. Yahoo Finance serves at most 7 days of 1m bars per request, so every
+# chunk that still has to be downloaded takes a single request.
+DEFAULT_CHUNK_DAYS = 5
+
+# Bars of warm up the strategy needs: after 500 bars the seeds of its slowest EMA (span 26) and ATR
+# (period 12) have decayed below double precision
+WARM_UP_BARS = 500
+
+# Calendar days a warm up reaches back at most. Yahoo Finance only serves about the last 30 days of
+# 1m bars, older requests come back empty.
+WARM_UP_DAYS = 30
+
+
+def iter_bars(ticker : str, start, end, interval='1m', chunk_days=DEFAULT_CHUNK_DAYS):
+  """
+  Yield the bars of a ticker in [start, end) as consecutive frames of at most chunk_days calendar
+  days each, so only one chunk is held in memory at a time.
+  """
+
+  window_start = pd.Timestamp(start).normalize()
+  end = pd.Timestamp(end)
+
+  while window_start < end:
+    window_end = min(window_start + pd.Timedelta(days=chunk_days), end)
+    data = market_data.get_history(ticker, start=window_start, end=window_end, interval=interval)
+    if len(data):
+      yield data
+    window_start = window_end
+
+def recent_bars(ticker : str, until, interval='1m', bars=WARM_UP_BARS, max_days=WARM_UP_DAYS,
+                chunk_days=DEFAULT_CHUNK_DAYS) -> pd.DataFrame:
+  """
+  The last bars (at most) of a ticker before until, fetched in chunks of chunk_days calendar days
+  walking back from until, no further than max_days.
+  """
+
+  until = pd.Timestamp(until)
+  earliest = until.normalize() - pd.Timedelta(days=max_days)
+  window_end = until
+  chunks = []
+  found = 0
+
+  while found < bars and window_end > earliest:
+    window_start = max(window_end.normalize() - pd.Timedelta(days=chunk_days), earliest)
+    data = market_data.get_history(ticker, start=window_start, end=window_end, interval=interval)
+    chunks.append(data)
+    found += len(data)
+    window_end = window_start
+
+  found = [data for data in chunks[::-1] if len(data)]
+  return pd.concat(found).iloc[-bars:] if found else chunks[0]
+
+def evaluate_intraday(ticker : str, start, end, interval='1m', chunk_days=DEFAULT_CHUNK_DAYS, state=None):
+  """
+  Run the strategy over intraday bars chunk by chunk and yield the trend analysis of every chunk,
+  with the columns of analysis.analyze_data. The EMA, ATR and band state is carried across chunk
+  boundaries in an indicators.StrategyState, so memory stays bounded by the chunk size however
+  long the history is, and the concatenated chunks equal analyze_data run on all bars at once.
+  Passing the state of an earlier run resumes it, bars up to its last_date are skipped.
+  """
+
+  if state is None:
+    state = indicators.StrategyState(*indicators.STRATEGY_PARAMS)
+
+  for data in iter_bars(ticker, start, end, interval, chunk_days):
+    if state.last_date is not None:
+      data = data.loc[data.index > pd.Timestamp(state.last_date)]
+    if len(data) == 0:
+      continue
+
+    with metrics.stage('intraday'):
+      chunk = trend_cache.analyze(state, data)
+    metrics.count('intraday_bars', len(chunk))
+
+    yield chunk
+
+def signal_changes(ticker : str, start, end, interval='1m', chunk_days=DEFAULT_CHUNK_DAYS) -> pd.DataFrame:
+  """
+  Bars on which the buy or sell signal of analysis.signal_masks switched on or off, found by
+  streaming the history through evaluate_intraday. Only the changes are kept, so the result stays
+  small for any history length.
+  """
+
+  changes = []
+  previous = None
+
+  for chunk in evaluate_intraday(ticker, start, end, interval, chunk_days):
+    buy = (chunk['Trend'] | chunk['Buy']).values
+    sell = (~chunk['Trend'] | chunk['Sell']).values
+
+    for i in range(len(chunk)):
+      current = (bool(buy[i]), bool(sell[i]))
+      if current != previous:
+        changes.append((chunk.index[i], chunk['Close'].iloc[i], current[0], current[1]))
+        previous = current
+
+  return pd.DataFrame(changes, columns=['Date', 'Close', 'Buy', 'Sell']).set_index('Date')
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Stream intraday bars through the strategy and list signal changes.')
+  parser.add_argument('ticker')
+  parser.add_argument('--start', required=True)
+  parser.add_argument('--end', required=True)
+  parser.add_argument('--interval', default='1m', help='Bar interval, e.g. 1m or 5m')
+  parser.add_argument('--chunk-days', type=int, default=DEFAULT_CHUNK_DAYS)
+  args = parser.parse_args()
+
+  print(signal_changes(args.ticker, args.start, args.end, args.interval, args.chunk_days).to_string())
@@ -0,0 +1,145 @@
+import os
+import uuid
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+  """
+  Raised inside a running job once it has been asked to stop.
+  """
+
+
+class Job:
+  """
+  A unit of work run by the JobManager. The work function receives a progress callback,
+  progress(done, total, stage='simulation'), which also raises JobCancelled once the job has been
+  cancelled. done and total count tickers in the 'signals' stage and days in the 'simulation' stage.
+  """
+
+  def __init__(self, fn, kwargs : dict):
+    self.id = uuid.uuid4().hex
+    self.fn = fn
+    self.kwargs = kwargs
+    self.status = QUEUED
+    self.stage = None
+    self.done = 0
+    self.total = 0
+    self.tickers_done = 0
+    self.tickers_total = 0
+    self.result = None
+    self.error = None
+    self.submitted = time.time()
+    self.started = None
+    self.finished = None
+    self.future = None
+    self._cancel = threading.Event()
+
+  def progress(self, done : int, total : int, stage='simulation'):
+    if self._cancel.is_set():
+      raise JobCancelled()
+    self.stage = stage
+    if stage == 'signals':
+      self.tickers_done, self.tickers_total = done, total
+    else:
+      self.done, self.total = done, total
+
+  def run(self):
+    if self._cancel.is_set():
+      return
+
+    self.status = RUNNING
+    self.started = time.time()
+    try:
+      self.result = self.fn(progress=self.progress, **self.kwargs)
+      self.status = DONE
+    except JobCancelled:
+      self.status = CANCELLED
+    except Exception as e:
+      self.error = repr(e)
+      self.status = FAILED
+    finally:
+      self.finished = time.time()
+
+  def describe(self) -> dict:
+    """
+    Status of the job as returned by the API. progress is the fraction of the current stage done.
+    """
+
+    if self.stage == 'signals':
+      progress = self.tickers_done/self.tickers_total if self.tickers_total else 0.0
+    else:
+      progress = self.done/self.total if self.total else (1.0 if self.status == DONE else 0.0)
+
+    return {
+      'job_id': self.id,
+      'status': self.status,
+      'stage': self.stage,
+      'progress': progress,
+      'tickers_done': self.tickers_done,
+      'tickers_total': self.tickers_total,
+      'days_done': self.done,
+      'days_total': self.total,
+      'submitted': self.submitted,
+      'started': self.started,
+      'finished': self.finished,
+      'error': self.error,
+    }
+
+
+class JobManager:
+  """
+  Runs submitted jobs on a pool of worker threads so callers, like the API's event loop, never block
+  on them. At most max_concurrent jobs run at once, the rest wait in the queue. Only the most recent
+  max_finished finished jobs are kept around for their results.
+  """
+
+  def __init__(self, max_concurrent=None, max_finished=100):
+    if max_concurrent is None:
+      max_concurrent = int(os.environ.get('ROBOTRADER_MAX_JOBS', 2))
+    self.max_finished = max_finished
+    self._pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='job')
+    self._jobs = OrderedDict()
+    self._lock = threading.Lock()
+
+  def submit(self, fn, **kwargs) -> Job:
+    job = Job(fn, kwargs)
+    with self._lock:
+      self._prune()
+      self._jobs[job.id] = job
+    job.future = self._pool.submit(job.run)
+    return job
+
+  def get(self, job_id : str):
+    with self._lock:
+      return self._jobs.get(job_id)
+
+  def cancel(self, job_id : str):
+    """
+    Cancel a job. A queued job never starts, a running one stops at its next progress report, which
+    it makes after every ticker of its signal precompute and every simulated day.
+    """
+
+    job = self.get(job_id)
+    if job is None:
+      return None
+
+    if job.status in (QUEUED, RUNNING):
+      job._cancel.set()
+      if job.future.cancel() or job.status == QUEUED:
+        job.status = CANCELLED
+        job.finished = time.time()
+    return job
+
+  def _prune(self):
+    finished = [job_id for job_id, job in self._jobs.items() if job.status in (DONE, FAILED, CANCELLED)]
+    for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+      del self._jobs[job_id]
@@ -0,0 +1,146 @@
+import numpy as np
+
+BUY = 0
+SALE = 1
+
+# One row per transaction, sales carry the buy price of the lot they close
+TRANSACTION_DTYPE = np.dtype([
+  ('kind', np.uint8),
+  ('ticker', np.int32),
+  ('date', 'datetime64[D]'),
+  ('amount', np.int64),
+  ('buy_price', np.float64),
+  ('sell_price', np.float64),
+])
+
+
+class Lot:
+  """
+  An open position created by a single buy. Supports lot['amount'] style access so code written
+  against the transaction dicts of the API works with it unchanged.
+  """
+
+  __slots__ = ('ticker', 'date', 'amount', 'buy_price')
+
+  def __init__(self, ticker : str, date : str, amount : int, buy_price : float):
+    self.ticker = ticker
+    self.date = date
+    self.amount = amount
+    self.buy_price = buy_price
+
+  def __getitem__(self, key : str):
+    return getattr(self, key)
+
+  def to_dict(self) -> dict:
+    return {'ticker': self.ticker, 'date': self.date, 'amount': self.amount, 'buy_price': self.buy_price}
+
+
+class Ledger:
+  """
+  Transaction log stored as a growable NumPy record array instead of a list of dicts. Tickers are
+  interned into integer ids. Capacity doubles whenever the array is full.
+  """
+
+  def __init__(self, capacity=1024):
+    self._records = np.empty(capacity, dtype=TRANSACTION_DTYPE)
+    self._size = 0
+    self.tickers = []
+    self._ids = dict()
+
+  def __len__(self) -> int:
+    return self._size
+
+  @property
+  def records(self) -> np.ndarray:
+    """
+    View of the recorded transactions, in the order they happened.
+    """
+    return self._records[:self._size]
+
+  def ticker_id(self, ticker : str) -> int:
+    if ticker not in self._ids:
+      self._ids[ticker] = len(self.tickers)
+      self.tickers.append(ticker)
+    return self._ids[ticker]
+
+  def _add(self, kind : int, ticker : str, date : str, amount : int, buy_price : float, sell_price : float):
+    if self._size == len(self._records):
+      grown = np.empty(max(2*len(self._records), 16), dtype=TRANSACTION_DTYPE)
+      grown[:self._size] = self._records[:self._size]
+      self._records = grown
+
+    self._records[self._size] = (kind, self.ticker_id(ticker), np.datetime64(date, 'D'), amount, buy_price, sell_price)
+    self._size += 1
+
+  def clear(self):
+    """
+    Drop the recorded transactions, e.g. once they have been streamed out. Ticker ids are kept.
+    """
+    self._size = 0
+
+  def add_buy(self, ticker : str, date : str, amount : int, buy_price : float):
+    self._add(BUY, ticker, date, amount, buy_price, np.nan)
+
+  def add_sale(self, ticker : str, date : str, amount : int, sell_price : float, buy_price : float):
+    self._add(SALE, ticker, date, amount, buy_price, sell_price)
+
+  def realized_pnl(self) -> dict:
+    """
+    Realized profit in dollars per ticker, summed over all sales.
+    """
+
+    records = self.records
+    sales = records[records['kind'] == SALE]
+    pnl = np.bincount(sales['ticker'], weights=(sales['sell_price'] - sales['buy_price'])*sales['amount'],
+                      minlength=len(self.tickers))
+    return dict(zip(self.tickers, pnl.tolist()))
+
+  def to_dicts(self) -> list[dict]:
+    """
+    Transactions in the JSON shape of simulator.generate_buy_transaction/generate_sale_transaction.
+    """
+
+    import simulator as sim
+
+    records = self.records
+    dates = np.datetime_as_string(records['date'], unit='D').tolist()
+    logs = []
+    for kind, ticker, date, amount, buy_price, sell_price in zip(records['kind'].tolist(), records['ticker'].tolist(),
+                                                                  dates, records['amount'].tolist(),
+                                                                  records['buy_price'].tolist(),
+                                                                  records['sell_price'].tolist()):
+      if kind == BUY:
+        logs.append(sim.generate_buy_transaction(self.tickers[ticker], date, amount, buy_price))
+      else:
+        logs.append(sim.generate_sale_transaction(self.tickers[ticker], date, amount, sell_price, buy_price))
+    return logs
+
+  def to_arrow(self):
+    """
+    Transactions as a pyarrow Table, built column by column. Requires pyarrow.
+    """
+
+    import pyarrow as pa
+
+    records = self.records
+    kinds = pa.DictionaryArray.from_arrays(pa.array(records['kind'].astype(np.int8)), pa.array(['buy', 'sale']))
+    tickers = pa.DictionaryArray.from_arrays(pa.array(records['ticker']), pa.array(self.tickers, type=pa.string()))
+    sell_price = pa.array(records['sell_price'], mask=records['kind'] == BUY)
+
+    return pa.table({
+      'kind': kinds,
+      'ticker': tickers,
+      'date': pa.array(records['date']),
+      'amount': pa.array(records['amount']),
+      'buy_price': pa.array(records['buy_price']),
+      'sell_price': sell_price,
+    })
+
+  def to_parquet(self, path : str):
+    """
+    Write all transactions to a Parquet file. Requires pyarrow.
+    """
+
+    import pyarrow.parquet as pq
+
+    pq.write_table(self.to_arrow(), path)
@@ -1,14 +1,17 @@
 import pandas as pd
-import yfinance as yf
 import numpy as np
-import matplotlib.pyplot as plt
+import metrics
+import visualize as viz
 
 def EMA(data, window):
   
   ema = data.ewm(
     span = window,
     adjust=False).mean()
-  ema.columns = ['EMA']
+
+  # Name the column of single series frames, multi ticker frames keep their ticker columns
+  if isinstance(ema, pd.DataFrame) and len(ema.columns) == 1:
+    ema.columns = ['EMA']
   return ema
 
 def MACD(data, a=12, b=26, c=9):
@@ -19,52 +22,44 @@ def MACD(data, a=12, b=26, c=9):
 
   return MACD_line, signal_line, histogram
 
-def evaluate_MACD(data, visualize=False):
-
-  df = data
-  close = data['Close']
+def crossovers(MACD_line, signal_line):
+  """
+  Find the bars on which the MACD line crosses its signal line. Crossing above while MACD is negative
+  is a buy signal, crossing below while MACD is positive is a sell signal. Works on 1-D arrays and on
+  dates x tickers arrays alike.
+  """
 
-  MACD_line, signal_line, histogram = MACD(close)
+  # Which line is on top, the MACD line wins ties
+  above = MACD_line >= signal_line
 
-  if visualize:
-    plt.plot(MACD_line, 'g', label = 'MACD Line')
-    plt.plot(signal_line, 'r', label = 'Signal Line')
-    plt.axhline(0)
-    plt.show()
+  # The first bar has nothing to cross from
+  crossed = np.zeros_like(above)
+  crossed[1:] = above[1:] != above[:-1]
 
-  MACD_list = MACD_line.tolist()
-  signal_list = signal_line.tolist()
+  buy_signal = crossed & above & (MACD_line < 0)
+  sell_signal = crossed & ~above & (MACD_line > 0)
 
-  buy_signal = [False] * len(MACD_list)
-  sell_signal = [False] * len(MACD_list)
+  return buy_signal, sell_signal
 
-  macd = 1
-  signal = 2
+@metrics.timed('macd')
+def evaluate_MACD(data, visualize=False, a=12, b=26, c=9):
 
-  prev = -1
-  for i in range(len(MACD_list)):
+  df = data
+  close = data['Close']
 
-    greater = -1
-    if MACD_list[i] >= signal_list[i]:
-      greater = macd
-    else:
-      greater = signal
-    
-    if greater != prev:
+  MACD_line, signal_line, histogram = MACD(close, a, b, c)
 
-      if not prev == -1 and (prev == signal and MACD_list[i] < 0):
-        buy_signal[i] = True
-      elif not prev == -1 and (prev == macd and MACD_list[i] > 0):
-        sell_signal[i] = True
+  if visualize:
+    viz.plot_macd(MACD_line, signal_line)
 
-    prev = greater
+  buy_signal, sell_signal = crossovers(MACD_line.values, signal_line.values)
 
   output = pd.DataFrame({
     'Close': close
   })
 
-  output['MACD'] = MACD_list
-  output['Signal'] = signal_list
+  output['MACD'] = MACD_line
+  output['Signal'] = signal_line
   output['Buy'] = buy_signal
   output['Sell'] = sell_signal
 
@@ -80,3 +75,20 @@ def evaluate_MACD(data, visualize=False):
     print(sell_locs)
 
   return output
+
+@metrics.timed('macd')
+def evaluate_MACD_panel(close : pd.DataFrame, a=12, b=26, c=9):
+  """
+  Evaluate the MACD strategy for a whole universe at once. Takes a dates x tickers frame of closing
+  prices and returns dates x tickers frames of buy and sell signals. Each column matches running
+  evaluate_MACD on that ticker alone, provided its missing values are leading ones (e.g. a ticker
+  that was listed later).
+  """
+
+  MACD_line, signal_line, histogram = MACD(close, a, b, c)
+  buy_signal, sell_signal = crossovers(MACD_line.values, signal_line.values)
+
+  buy = pd.DataFrame(buy_signal, index=close.index, columns=close.columns)
+  sell = pd.DataFrame(sell_signal, index=close.index, columns=close.columns)
+
+  return buy, sell
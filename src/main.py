@@ -1,16 +1,34 @@
+import os
+import threading
 from typing import Union
 
-from fastapi import FastAPI
-from backtesting import backtest
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from backtesting import run_backtest, run_backtest_batch, stream_backtest, ndjson_stream, arrow_stream, backtest_days
+from jobs import JobManager, DONE
+import metrics
 import simulator as sim
+import screener
+import streaming
+import ticker_universe
 from pydantic import BaseModel 
-from datetime import datetime 
+from datetime import datetime, timedelta
 
 class BacktestRequest(BaseModel):
     tickers: Union[list[str], None] = None
     starting_balance: float
     start_date: Union[str, None] = None
     end_date: Union[str, None] = None
+    engine: Union[str, None] = None
+    workers: Union[int, None] = None
+    profile: Union[bool, None] = None
+    stream: Union[str, None] = None
+    dtype: Union[str, None] = None
+
+class BatchBacktestRequest(BaseModel):
+    portfolios: list[BacktestRequest]
+    workers: Union[int, None] = None
 
 class UserRequest(BaseModel):
     tickers: list[str]
@@ -19,11 +37,28 @@ class UserRequest(BaseModel):
     balance: float
 
 app = FastAPI()
+jobs = JobManager()
+
+# Streamed backtests do not go through the job queue, they wait for one of these slots instead
+stream_slots = threading.BoundedSemaphore(int(os.environ.get('ROBOTRADER_MAX_STREAMS', 2)))
+
+def limited(chunks):
+    with stream_slots:
+        yield from chunks
+
+# Builds the bar feed of a /ws/signals connection from (tickers, start, end, interval=, speed=).
+# Replace with a live feed to stream real bars.
+feed_factory = streaming.ReplayFeed
 
 @app.get("/")
 async def root():
     return {"Project":"RoboTrader"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus scrape target, stages are only timed while ROBOTRADER_METRICS=1
+    return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
 @app.post("/backtest/")
 async def create_backtest_request(req : BacktestRequest):
 
@@ -32,13 +67,97 @@ async def create_backtest_request(req : BacktestRequest):
         "starting_balance": req.starting_balance,
         "start_date": req.start_date,
         "end_date": req.end_date,
+        "engine": req.engine,
+        "workers": req.workers,
+        "profile": req.profile,
+        "dtype": req.dtype,
     }
 
     not_none_params = {k:v for k, v in params.items() if v is not None}
-    return backtest(**not_none_params)
 
+    # Reject an unknown engine or a range without trading days now rather than as a failed job or
+    # a stream that breaks off after the response has started. The check runs in the thread pool,
+    # the first one builds the trading calendar.
+    try:
+        await run_in_threadpool(backtest_days, **{k:v for k, v in not_none_params.items()
+                                                  if k in ('start_date', 'end_date', 'engine', 'dtype')})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Streamed backtests send their trades, daily balances and positions while they run, as
+    # newline delimited JSON or as an Arrow IPC stream, instead of becoming a job
+    if req.stream is not None:
+        encoders = {'ndjson': (ndjson_stream, 'application/x-ndjson'),
+                    'arrow': (arrow_stream, 'application/vnd.apache.arrow.stream')}
+        if req.stream not in encoders:
+            raise HTTPException(status_code=400, detail='Unknown stream format ' + req.stream)
+        if req.profile:
+            raise HTTPException(status_code=400, detail='profile is not available for streamed backtests')
+        if req.workers is not None and req.workers > 1:
+            raise HTTPException(status_code=400, detail='Streamed backtests run with a single worker')
+        not_none_params.pop('profile', None)
+        encode, media_type = encoders[req.stream]
+        return StreamingResponse(limited(encode(stream_backtest(**not_none_params))), media_type=media_type)
+
+    # Run the backtest in the background, the client polls for its status and result
+    job = jobs.submit(run_backtest, **not_none_params)
+    return job.describe()
+
+@app.post("/backtest/batch/")
+async def create_batch_backtest_request(req : BatchBacktestRequest):
+
+    # Every portfolio is simulated against signals computed once for all of them, engine and
+    # workers of the individual portfolios do not apply
+    portfolios = [{
+        "tickers": portfolio.tickers,
+        "starting_balance": portfolio.starting_balance,
+        "start_date": portfolio.start_date,
+        "end_date": portfolio.end_date,
+    } for portfolio in req.portfolios]
+
+    params = {"portfolios": portfolios}
+    if req.workers is not None:
+        params["workers"] = req.workers
+
+    # The job's result is the list of per-portfolio results, in request order
+    job = jobs.submit(run_backtest_batch, **params)
+    return job.describe()
+
+def get_job(job_id : str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Unknown job ' + job_id)
+    return job
+
+@app.get("/backtest/{job_id}")
+async def backtest_status(job_id : str):
+    return get_job(job_id).describe()
+
+@app.get("/backtest/{job_id}/result")
+async def backtest_result(job_id : str):
+
+    job = get_job(job_id)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail='Job is ' + job.status)
+    return job.result
+
+@app.delete("/backtest/{job_id}")
+async def cancel_backtest(job_id : str):
+    get_job(job_id)
+    return jobs.cancel(job_id).describe()
+
+@app.get("/screen/")
+def screen(date : Union[str, None] = None, tickers : Union[str, None] = None):
+    # Read only: signals of the whole universe for trading on date (default today), no trades are made.
+    # tickers optionally restricts the universe to a comma separated list. Declared without async so
+    # the computation runs in the server's threadpool.
+    universe = [ticker.strip() for ticker in tickers.split(',') if ticker.strip()] if tickers else None
+    return screener.screen(universe, date)
+
+# Declared without async so concurrent requests run in the server's threadpool, where lookups of
+# the same ticker are coalesced by the shared signal cache
 @app.post("/trading_day/")
-async def trading_day(req : UserRequest):
+def trading_day(req : UserRequest):
 
     today = datetime.today().strftime('%Y-%m-%d')
 
@@ -50,4 +169,29 @@ async def trading_day(req : UserRequest):
         "logs": req.logs
     }
 
-    return sim.simulate_daily_trade(**params)
\ No newline at end of file
+    return sim.simulate_daily_trades(**params)
+
+@app.websocket("/ws/signals")
+async def signal_stream(websocket : WebSocket, start : str, end : Union[str, None] = None,
+                        tickers : Union[str, None] = None, interval : str = '1d', speed : Union[float, None] = None):
+    # Push buy/sell signal changes as the bars of [start, end) arrive from the feed. The first
+    # message is a snapshot of the signals before start, the last one marks the end of the feed.
+    await websocket.accept()
+
+    universe = [ticker.strip() for ticker in tickers.split(',') if ticker.strip()] if tickers \
+        else ticker_universe.read_tickers()
+    if end is None:
+        end = str((datetime.today() + timedelta(days=1)).date())
+
+    engine = streaming.SignalEngine()
+    await run_in_threadpool(engine.warm_up, universe, start, interval)
+    await websocket.send_json({'type': 'snapshot', 'time': start, 'signals': engine.snapshot()})
+
+    try:
+        feed = feed_factory(universe, start, end, interval=interval, speed=speed)
+        async for event in streaming.signal_changes(feed, engine):
+            await websocket.send_json(event)
+        await websocket.send_json({'type': 'end'})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
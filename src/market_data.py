@@ -0,0 +1,710 @@
+import io
+import os
+import json
+import threading
+import contextlib
+import datetime as dt
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import caching
+import metrics
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+# Columns every provider returns, in the order Yahoo Finance uses
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser('~'), '.robotrader', 'data')
+
+# Number of stored bars at the edge of the stored range that every gap fill downloads again. Yahoo
+# Finance adjusts past prices for splits and dividends, if these bars changed the ticker is rewritten.
+REVISION_BARS = 5
+
+# Columns compared by the revision check, Volume is only split adjusted and often revised intraday
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+
+def _to_day(date) -> np.datetime64:
+  """
+  Normalize a date given as a string, datetime or numpy datetime to a numpy day.
+  """
+  return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+def _empty_frame() -> pd.DataFrame:
+  """
+  Frame with the standard OHLCV columns and no rows.
+  """
+  return pd.DataFrame({field: pd.Series(dtype=float) for field in FIELDS},
+                      index=pd.DatetimeIndex([], name='Date'))
+
+def _normalize(frame : pd.DataFrame) -> pd.DataFrame:
+  """
+  Bring a downloaded frame into the layout shared by every provider: a sorted, timezone naive
+  DatetimeIndex named 'Date' and the standard OHLCV columns.
+  """
+
+  if frame is None or len(frame) == 0:
+    return _empty_frame()
+
+  # Newer versions of yfinance return a (field, ticker) column MultiIndex even for a single ticker
+  if isinstance(frame.columns, pd.MultiIndex):
+    frame = frame.droplevel(1, axis=1)
+
+  frame = frame.copy()
+  if 'Adj Close' not in frame.columns:
+    frame['Adj Close'] = frame['Close']
+
+  index = pd.DatetimeIndex(frame.index)
+  if index.tz is not None:
+    index = index.tz_localize(None)
+  frame.index = index.rename('Date')
+
+  frame = frame[~frame.index.duplicated(keep='last')].sort_index()
+  return frame[FIELDS].astype(float)
+
+def slice_range(frame : pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+  """
+  Restrict a frame to the half open date range [start, end), mirroring yf.download. The frame's
+  index must be sorted, as _normalize leaves it, so the range is found by binary search.
+  """
+
+  lo = 0 if start is None else frame.index.searchsorted(pd.Timestamp(start), 'left')
+  hi = len(frame) if end is None else frame.index.searchsorted(pd.Timestamp(end), 'left')
+  return frame.iloc[lo:max(lo, hi)].copy()
+
+
+class MarketDataProvider:
+  """
+  Source of historical OHLCV bars. Implementations return a frame indexed by date holding the
+  columns in FIELDS for the half open range [start, end).
+  """
+
+  def history(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+    raise NotImplementedError
+
+  def quotes(self, tickers : list[str]) -> dict:
+    """
+    Latest price of every ticker, fetched in one batch where the source allows it.
+    """
+
+    latest = dict()
+    for ticker in tickers:
+      data = self.history(ticker, start=pd.Timestamp(dt.date.today()) - pd.Timedelta(days=7))
+      if len(data):
+        latest[ticker] = float(data['Close'].iloc[-1])
+    return latest
+
+
+class YahooProvider(MarketDataProvider):
+  """
+  Download bars from the Yahoo Finance API.
+  """
+
+  def history(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+    import yfinance as yf
+
+    data = yf.download(ticker, start=start, end=end, interval=interval, auto_adjust=False, progress=False)
+    return _normalize(data)
+
+  def quotes(self, tickers : list[str]) -> dict:
+    import yfinance as yf
+
+    if not tickers:
+      return dict()
+
+    # One request for all tickers, the last minute bar of today holds the current price
+    data = yf.download(list(tickers), period='1d', interval='1m', auto_adjust=False, progress=False)
+    close = data['Close']
+    if isinstance(close, pd.Series):
+      close = close.to_frame(tickers[0])
+    latest = close.ffill().iloc[-1] if len(close) else pd.Series(dtype=float)
+
+    return {ticker: float(latest[ticker]) for ticker in tickers if ticker in latest and latest[ticker] == latest[ticker]}
+
+
+class FileProvider(MarketDataProvider):
+  """
+  Offline provider reading one CSV per ticker ('<directory>/<TICKER>.csv') in the format written by
+  DataFrame.to_csv on a yf.download result. Files are read in chunks of chunk_rows rows and only
+  the requested range is kept, so memory does not grow with the size of the file.
+  """
+
+  def __init__(self, directory : str, chunk_rows=10000):
+    self.directory = directory
+    self.chunk_rows = chunk_rows
+
+  def history(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+    path = os.path.join(self.directory, ticker + '.csv')
+    if not os.path.exists(path):
+      return _empty_frame()
+
+    parts = []
+    for chunk in pd.read_csv(path, index_col=0, parse_dates=True, chunksize=self.chunk_rows):
+      chunk = _normalize(chunk)
+      # Files are in date order, nothing after a chunk starting past the end is needed
+      if end is not None and len(chunk) and chunk.index[0] >= pd.Timestamp(end):
+        break
+      parts.append(slice_range(chunk, start, end))
+
+    return _normalize(pd.concat(parts)) if parts else _empty_frame()
+
+
+class ColumnarStore:
+  """
+  On-disk columnar store of OHLCV bars. Every ticker gets its own directory holding one .npy array
+  per column, so reads are memory-mapped rather than parsed. A meta.json file records the number of
+  rows and the date range [start, end) that has already been fetched, which lets the store tell a
+  market holiday apart from data it has never seen.
+  """
+
+  def __init__(self, root=DEFAULT_STORE_DIR):
+    self.root = root
+    self._locks = dict()
+    self._locks_lock = threading.Lock()
+
+  # Stores are sent to worker processes along with their provider, the locks of this process stay behind
+  def __getstate__(self) -> dict:
+    return {'root': self.root}
+
+  def __setstate__(self, state : dict):
+    self.__init__(state['root'])
+
+  def _path(self, ticker : str, interval : str) -> str:
+    return os.path.join(self.root, interval, ticker.replace('/', '_'))
+
+  @contextlib.contextmanager
+  def lock(self, ticker : str, interval='1d'):
+    """
+    Hold the write lock of a ticker: one thread of this process and, where fcntl is available, one
+    process at a time.
+    """
+
+    path = self._path(ticker, interval)
+    with self._locks_lock:
+      thread_lock = self._locks.setdefault(path, threading.Lock())
+
+    with thread_lock:
+      if fcntl is None:
+        yield
+        return
+      os.makedirs(path, exist_ok=True)
+      with open(os.path.join(path, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+          yield
+        finally:
+          fcntl.flock(f, fcntl.LOCK_UN)
+
+  def edge(self, ticker : str, count : int, interval='1d', last=True) -> pd.DataFrame:
+    """
+    The last (or first) count stored bars of a ticker.
+    """
+
+    mapped = self._columns(ticker, interval)
+    if mapped is None:
+      return _empty_frame()
+    rows = len(mapped[0])
+    return self._frame(*mapped, max(rows - count, 0) if last else 0, rows if last else min(count, rows))
+
+  def coverage(self, ticker : str, interval='1d'):
+    """
+    Return the (start, end) range of days already stored for a ticker, or None if nothing is stored.
+    """
+
+    meta = self._meta(ticker, interval)
+    if meta is None:
+      return None
+    return np.datetime64(meta['start'], 'D'), np.datetime64(meta['end'], 'D')
+
+  def _meta(self, ticker : str, interval : str):
+    path = os.path.join(self._path(ticker, interval), 'meta.json')
+    try:
+      with open(path) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def read(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+    """
+    Read the stored bars of a ticker within [start, end).
+    """
+
+    mapped = self._columns(ticker, interval)
+    if mapped is None:
+      return _empty_frame()
+    dates = mapped[0]
+
+    # Binary search the requested range so only the needed rows are paged in
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 'ns'), 'left')
+    hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end), 'ns'), 'left')
+
+    return self._frame(*mapped, lo, hi)
+
+  def _columns(self, ticker : str, interval : str):
+    """
+    Memory map the stored dates and columns of a ticker, None if nothing (consistent) is stored.
+    """
+
+    meta = self._meta(ticker, interval)
+    if meta is None:
+      return None
+
+    path = self._path(ticker, interval)
+    try:
+      dates = np.load(os.path.join(path, 'Date.npy'), mmap_mode='r')
+      columns = {field: np.load(os.path.join(path, field + '.npy'), mmap_mode='r') for field in FIELDS}
+    except (OSError, ValueError):
+      return None
+
+    # A partially written update leaves columns shorter than meta.json says, treat it as a cache miss.
+    # Columns may be longer while an append is under way, its rows count once meta.json does.
+    rows = meta['rows']
+    if any(len(column) < rows for column in columns.values()) or len(dates) < rows:
+      return None
+    return dates[:rows], {field: column[:rows] for field, column in columns.items()}
+
+  def _frame(self, dates : np.ndarray, columns : dict, lo : int, hi : int) -> pd.DataFrame:
+    return pd.DataFrame({field: np.array(columns[field][lo:hi]) for field in FIELDS},
+                        index=pd.DatetimeIndex(np.array(dates[lo:hi]), name='Date'))
+
+  def write(self, ticker : str, frame : pd.DataFrame, start, end, interval='1d', replace=False):
+    """
+    Merge new bars into the store and extend the recorded coverage to include [start, end).
+    Rows in the new frame replace stored rows with the same date. With replace=True the stored bars
+    are dropped and the coverage becomes [start, end).
+    """
+
+    frame = _normalize(frame)
+    coverage = None if replace else self.coverage(ticker, interval)
+
+    start, end = _to_day(start), _to_day(end)
+    if coverage is not None:
+      start, end = min(start, coverage[0]), max(end, coverage[1])
+
+    path = self._path(ticker, interval)
+    os.makedirs(path, exist_ok=True)
+    # Temporary names are unique per writer, so even unlocked writers never write into the same file
+    suffix = '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+
+    # Bars after the last stored one are appended in place, so filling a long history chunk by chunk
+    # never reads or rewrites what is already stored
+    mapped = None if replace else self._columns(ticker, interval)
+    if mapped is not None and len(mapped[0]) and (len(frame) == 0 or frame.index.values[0] > mapped[0][-1]):
+      rows = len(mapped[0])
+      del mapped
+      if self._append(path, rows, frame):
+        self._write_meta(path, rows + len(frame), start, end, suffix)
+        return
+
+    # Concatenating an empty frame is deprecated in pandas, and there is nothing to merge with anyway
+    stored = None if replace else self.read(ticker, interval=interval)
+    if stored is None or len(stored) == 0:
+      merged = frame
+    elif len(frame) == 0:
+      merged = stored
+    else:
+      merged = _normalize(pd.concat([stored, frame]))
+
+    # Write every column to a temporary file first so readers never map a truncated array
+    for name, values in self._column_arrays(merged).items():
+      tmp = os.path.join(path, name + suffix)
+      with open(tmp, 'wb') as f:
+        np.save(f, values)
+      os.replace(tmp, os.path.join(path, name + '.npy'))
+
+    self._write_meta(path, len(merged), start, end, suffix)
+
+  def _column_arrays(self, frame : pd.DataFrame) -> dict:
+    columns = {'Date': frame.index.values.astype('datetime64[ns]')}
+    columns.update({field: frame[field].values.astype(float) for field in FIELDS})
+    return columns
+
+  def _write_meta(self, path : str, rows : int, start, end, suffix : str):
+    tmp = os.path.join(path, 'meta' + suffix)
+    with open(tmp, 'w') as f:
+      json.dump({'rows': rows, 'start': str(start), 'end': str(end)}, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+  def _append(self, path : str, rows : int, frame : pd.DataFrame) -> bool:
+    """
+    Append rows to the column files in place and grow the shape in their headers, which numpy pads
+    for this. Readers keep seeing the old rows until meta.json is replaced. Returns False, having
+    changed nothing, if a header has no room to grow.
+    """
+
+    columns = self._column_arrays(frame)
+    files = dict()
+    try:
+      for name, values in columns.items():
+        f = files[name] = open(os.path.join(path, name + '.npy'), 'r+b')
+        if np.lib.format.read_magic(f) != (1, 0):
+          return False
+        np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(values.dtype),
+                                                      'fortran_order': False, 'shape': (rows + len(values),)})
+        if header.tell() != offset:
+          return False
+        files[name] = (f, offset, header.getvalue())
+
+      for name, values in columns.items():
+        f, offset, header = files[name]
+        # Write after the rows meta.json counts, anything beyond is left over from an interrupted append
+        f.seek(offset + rows*values.dtype.itemsize)
+        f.write(values.tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(header)
+      return True
+    finally:
+      for f in files.values():
+        (f[0] if isinstance(f, tuple) else f).close()
+
+
+class StoreProvider(MarketDataProvider):
+  """
+  Serve bars from a ColumnarStore, filling any part of the requested range that has not been
+  stored yet from an upstream provider. Without an upstream provider the store is used as is,
+  which allows running entirely offline.
+  """
+
+  def __init__(self, store : ColumnarStore, upstream=None):
+    self.store = store
+    self.upstream = upstream
+
+  def history(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+
+    if self.upstream is not None:
+      self._fill_gaps(ticker, start, end, interval)
+
+    return self.store.read(ticker, start, end, interval)
+
+  def quotes(self, tickers : list[str]) -> dict:
+    # Live prices are never stored, ask the upstream provider directly
+    if self.upstream is not None:
+      return self.upstream.quotes(tickers)
+    return MarketDataProvider.quotes(self, tickers)
+
+  def _fill_gaps(self, ticker : str, start, end, interval : str):
+    """
+    Fetch only the parts of [start, end) that are missing on disk.
+    """
+
+    # Never mark today as covered, its bar is still changing while the market is open
+    today = np.datetime64(dt.date.today(), 'D')
+    start = _to_day(start) if start is not None else np.datetime64('1970-01-01', 'D')
+    end = min(_to_day(end), today) if end is not None else today
+
+    if start >= end:
+      return
+
+    coverage = self.store.coverage(ticker, interval)
+    if coverage is not None and coverage[0] <= start and end <= coverage[1]:
+      return
+
+    # Threads and processes filling the same ticker take turns, the later ones find it filled
+    with self.store.lock(ticker, interval):
+      self._fill_locked(ticker, start, end, interval)
+
+  def _fill_locked(self, ticker : str, start : np.datetime64, end : np.datetime64, interval : str):
+    coverage = self.store.coverage(ticker, interval)
+
+    # Determine which ranges still need to be downloaded
+    if coverage is None:
+      gaps = [(start, end)]
+    else:
+      gaps = []
+      if start < coverage[0]:
+        gaps.append((start, coverage[0]))
+      if end > coverage[1]:
+        gaps.append((coverage[1], end))
+
+    for gap_start, gap_end in gaps:
+      # Download the stored bars next to the gap again, to check they were not adjusted since
+      stored = _empty_frame()
+      fetch_start, fetch_end = gap_start, gap_end
+      if coverage is not None:
+        stored = self.store.edge(ticker, REVISION_BARS, interval, last=gap_start >= coverage[1])
+        if len(stored) and gap_start >= coverage[1]:
+          fetch_start = _to_day(stored.index[0])
+        elif len(stored):
+          fetch_end = _to_day(stored.index[-1]) + 1
+
+      fetched = _normalize(self.upstream.history(ticker, start=str(fetch_start), end=str(fetch_end), interval=interval))
+
+      common = stored.index.intersection(fetched.index)
+      if len(common) and not np.allclose(fetched.loc[common, PRICE_FIELDS].values, stored.loc[common, PRICE_FIELDS].values,
+                                         rtol=1e-6, equal_nan=True):
+        self._rewrite(ticker, min(start, coverage[0]), max(end, coverage[1]), interval)
+        return
+
+      fetched = slice_range(fetched, gap_start, gap_end)
+
+      # yf.download answers a network error or an unknown symbol with an empty frame, so an empty
+      # fetch leaves the gap uncovered to be tried again, unless the gap has no weekday to hold a bar
+      if len(fetched) == 0:
+        if np.busday_count(gap_start, gap_end) == 0:
+          self.store.write(ticker, fetched, gap_start, gap_end, interval)
+        continue
+
+      # At the end of the stored range only count days up to the last bar received as covered
+      last_day = _to_day(fetched.index[-1]) + 1
+      if (coverage is None or gap_end > coverage[1]) and np.busday_count(last_day, gap_end) > 0:
+        gap_end = max(last_day, gap_start + 1)
+      self.store.write(ticker, fetched, gap_start, gap_end, interval)
+
+  def _rewrite(self, ticker : str, start : np.datetime64, end : np.datetime64, interval : str):
+    """
+    Replace the stored bars of a ticker with a fresh download of [start, end), after upstream
+    revised bars that were already stored.
+    """
+
+    fetched = _normalize(self.upstream.history(ticker, start=str(start), end=str(end), interval=interval))
+    metrics.count('store_rewrites')
+
+    # Keep the stored bars rather than nothing if the download failed
+    if len(fetched) == 0:
+      return
+
+    last_day = _to_day(fetched.index[-1]) + 1
+    if np.busday_count(last_day, end) > 0:
+      end = max(last_day, start + 1)
+    self.store.write(ticker, fetched, start, end, interval, replace=True)
+
+
+_provider = None
+
+def default_provider() -> MarketDataProvider:
+  """
+  Build the provider described by the environment:
+  ROBOTRADER_DATA_DIR selects the store location,
+  ROBOTRADER_CSV_DIR fills the store from local CSV files instead of Yahoo Finance and
+  ROBOTRADER_OFFLINE=1 disables downloading altogether.
+  """
+
+  store = ColumnarStore(os.environ.get('ROBOTRADER_DATA_DIR', DEFAULT_STORE_DIR))
+
+  if os.environ.get('ROBOTRADER_OFFLINE') == '1':
+    upstream = None
+  elif os.environ.get('ROBOTRADER_CSV_DIR'):
+    upstream = FileProvider(os.environ['ROBOTRADER_CSV_DIR'])
+  else:
+    upstream = YahooProvider()
+
+  return StoreProvider(store, upstream)
+
+def get_provider() -> MarketDataProvider:
+  """
+  Return the process wide market data provider, creating the default one on first use.
+  """
+
+  global _provider
+  if _provider is None:
+    _provider = default_provider()
+  return _provider
+
+def set_provider(provider : MarketDataProvider):
+  """
+  Replace the process wide market data provider, e.g. with a FileProvider for offline backtests.
+  """
+
+  global _provider
+  _provider = provider
+
+@metrics.timed('data_fetch')
+def get_history(ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+  """
+  Retrieve the bars of a ticker for [start, end) from the active provider.
+  """
+  return get_provider().history(ticker, start=start, end=end, interval=interval)
+
+@metrics.timed('data_fetch')
+def get_panel(tickers : list[str], start=None, end=None, fields=('High', 'Low', 'Close'), interval='1d',
+              workers=8) -> dict:
+  """
+  Retrieve the bars of many tickers for [start, end) as one aligned panel: a dates x tickers frame per
+  field, indexed by the union of their bar dates. Days a ticker has no bar are NaN. Fetching is I/O
+  bound, so the histories are retrieved on a pool of threads.
+  """
+
+  if len(tickers) == 0:
+    return {field: pd.DataFrame(index=pd.DatetimeIndex([], name='Date')) for field in fields}
+
+  fetch = lambda ticker: get_history(ticker, start=start, end=end, interval=interval)
+  if workers > 1 and len(tickers) > 1:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      histories = list(pool.map(fetch, tickers))
+  else:
+    histories = [fetch(ticker) for ticker in tickers]
+
+  return {field: pd.concat([data[field] for data in histories], axis=1, keys=list(tickers)).sort_index()
+          for field in fields}
+
+def period_start(period : str, end=None) -> pd.Timestamp:
+  """
+  Translate a Yahoo Finance style period ('5d', '3mo', '2y', 'ytd', 'max') into a start date.
+  """
+
+  end = pd.Timestamp(end if end is not None else dt.date.today()).normalize()
+
+  if period == 'max':
+    return pd.Timestamp('1970-01-01')
+  if period == 'ytd':
+    return pd.Timestamp(end.year, 1, 1)
+  if period.endswith('mo'):
+    return end - pd.DateOffset(months=int(period[:-2]))
+  if period.endswith('wk'):
+    return end - pd.DateOffset(weeks=int(period[:-2]))
+  if period.endswith('y'):
+    return end - pd.DateOffset(years=int(period[:-1]))
+  if period.endswith('d'):
+    # Periods in days count trading days, leave room for weekends and holidays
+    return end - pd.DateOffset(days=2*int(period[:-1]) + 7)
+
+  raise ValueError('Unknown period: ' + period)
+
+def get_period(ticker : str, period : str, end=None) -> pd.DataFrame:
+  """
+  Retrieve the bars of a ticker for a Yahoo Finance style period ending at the given date (today by default).
+  """
+
+  if end is None:
+    end = pd.Timestamp(dt.date.today()) + pd.Timedelta(days=1)
+
+  data = get_history(ticker, start=period_start(period, end), end=end)
+
+  # A period of N days means the last N trading days
+  if period.endswith('d') and not period.endswith('ytd'):
+    data = data.iloc[-int(period[:-1]):]
+
+  return data
+
+
+class OpeningPrices:
+  """
+  Execution prices for backtests. The split and dividend adjusted opening prices of every ticker are
+  read in bulk once, after which the prices of all tickers traded on a date come from a single
+  lookup. Like simulator.get_opening_price, the price on a date is the open of the first bar on or
+  within a week after it.
+  """
+
+  def __init__(self, tickers : list[str], dates):
+    self.dates = np.asarray(dates, dtype='datetime64[D]')
+    self.tickers = list(tickers)
+    self._columns = {ticker: j for j, ticker in enumerate(self.tickers)}
+    self.matrix = np.full((len(self.dates), len(self.tickers)), np.nan)
+
+    if len(self.dates) == 0:
+      return
+
+    start = pd.Timestamp(self.dates[0])
+    end = pd.Timestamp(self.dates[-1]) + pd.Timedelta(days=7)
+    week_later = self.dates + 7
+
+    for j, ticker in enumerate(self.tickers):
+      data = get_history(ticker, start=start, end=end)
+      bar_days = data.index.values.astype('datetime64[D]')
+      adjusted_open = (data['Open'] * (data['Adj Close'] / data['Close'])).values
+
+      # First bar on or after each date, if there is one within a week
+      i = np.searchsorted(bar_days, self.dates, 'left')
+      found = i < len(bar_days)
+      found[found] = bar_days[i[found]] < week_later[found]
+      self.matrix[found, j] = adjusted_open[i[found]]
+
+  def prices(self, tickers : list[str], date) -> dict:
+    """
+    Opening prices on a date of the given tickers, tickers without a known price are left out.
+    """
+
+    day = np.datetime64(date, 'D')
+    row = np.searchsorted(self.dates, day)
+    if row == len(self.dates) or self.dates[row] != day:
+      return dict()
+
+    prices = dict()
+    for ticker in tickers:
+      j = self._columns.get(ticker)
+      if j is not None and self.matrix[row, j] == self.matrix[row, j]:
+        prices[ticker] = float(self.matrix[row, j])
+    return prices
+
+
+class QuoteCache:
+  """
+  Live quotes shared by concurrent trading day requests. Quotes are reused for ttl seconds. Tickers
+  that are not cached are fetched in one batch per call, and a ticker already being fetched for another
+  caller is waited on instead of being requested again.
+  """
+
+  def __init__(self, ttl=None, provider=None):
+    if ttl is None:
+      ttl = float(os.environ.get('ROBOTRADER_QUOTE_TTL', 15))
+    self.provider = provider
+    self._cache = caching.TTLCache(ttl)
+    self._in_flight = dict()
+    self._lock = threading.Lock()
+
+  def prices(self, tickers : list[str], date=None) -> dict:
+    """
+    Current prices of the given tickers. date is accepted for symmetry with OpeningPrices.
+    """
+
+    prices = dict()
+    waiting = dict()
+    to_fetch = []
+
+    with self._lock:
+      for ticker in dict.fromkeys(tickers):
+        price = self._cache.get(ticker)
+        if price is not None:
+          prices[ticker] = price
+        elif ticker in self._in_flight:
+          waiting[ticker] = self._in_flight[ticker]
+        else:
+          future = Future()
+          self._in_flight[ticker] = future
+          waiting[ticker] = future
+          to_fetch.append(ticker)
+
+    if to_fetch:
+      try:
+        fetched = (self.provider or get_provider()).quotes(to_fetch)
+      except Exception as e:
+        fetched = e
+
+      with self._lock:
+        for ticker in to_fetch:
+          future = self._in_flight.pop(ticker)
+          if isinstance(fetched, Exception):
+            future.set_exception(fetched)
+          else:
+            if ticker in fetched:
+              self._cache.set(ticker, fetched[ticker])
+            future.set_result(fetched.get(ticker))
+
+    for ticker, future in waiting.items():
+      price = future.result()
+      if price is not None:
+        prices[ticker] = price
+
+    return prices
+
+
+_quote_cache = None
+
+def get_quote_cache() -> QuoteCache:
+  """
+  Process wide live quote cache.
+  """
+
+  global _quote_cache
+  if _quote_cache is None:
+    _quote_cache = QuoteCache()
+  return _quote_cache
@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+import functools
+
+# Stage timings and event counters. Collection is off unless ROBOTRADER_METRICS=1 is set, enable() is
+# called or a profile() is active, and while off every hook costs a single global flag check.
+
+_enabled = os.environ.get('ROBOTRADER_METRICS') == '1'
+_profiles = 0
+_active = _enabled
+
+_lock = threading.Lock()
+_stages = dict()
+_counters = dict()
+_local = threading.local()
+
+
+def _refresh():
+  global _active
+  _active = _enabled or _profiles > 0
+
+def enable():
+  global _enabled
+  _enabled = True
+  _refresh()
+
+def disable():
+  global _enabled
+  _enabled = False
+  _refresh()
+
+def reset():
+  with _lock:
+    _stages.clear()
+    _counters.clear()
+
+
+class _Stage:
+
+  __slots__ = ('name', 'start')
+
+  def __init__(self, name : str):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    elapsed = time.perf_counter() - self.start
+
+    if _enabled:
+      with _lock:
+        calls, seconds = _stages.get(self.name, (0, 0.0))
+        _stages[self.name] = (calls + 1, seconds + elapsed)
+
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+      calls, seconds = profile.get(self.name, (0, 0.0))
+      profile[self.name] = (calls + 1, seconds + elapsed)
+    return False
+
+
+class _NullStage:
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name : str):
+  """
+  Context manager timing a stage, e.g. 'with metrics.stage("data_fetch"):'.
+  """
+
+  if not _active:
+    return _NULL_STAGE
+  return _Stage(name)
+
+def timed(name : str):
+  """
+  Decorator timing every call of a function as the given stage.
+  """
+
+  def decorator(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if not _active:
+        return fn(*args, **kwargs)
+      with _Stage(name):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def count(name : str, value=1):
+  """
+  Increase an event counter, e.g. the number of tickers evaluated or trading days simulated.
+  """
+
+  if not _active:
+    return
+
+  if _enabled:
+    with _lock:
+      _counters[name] = _counters.get(name, 0) + value
+
+  profile = getattr(_local, 'profile', None)
+  if profile is not None:
+    profile['#' + name] = profile.get('#' + name, 0) + value
+
+
+class profile:
+  """
+  Collect the stages and counters of everything run by the current thread inside the block,
+  independently of the global metrics. Work done in other threads or processes is not included.
+
+    with metrics.profile() as run:
+      ...
+    run.summary()
+  """
+
+  def __init__(self):
+    self.data = dict()
+    self._outer = None
+
+  def __enter__(self):
+    global _profiles
+    self._outer = getattr(_local, 'profile', None)
+    _local.profile = self.data
+    with _lock:
+      _profiles += 1
+      _refresh()
+    return self
+
+  def __exit__(self, *exc):
+    global _profiles
+    _local.profile = self._outer
+    with _lock:
+      _profiles -= 1
+      _refresh()
+    return False
+
+  def summary(self) -> dict:
+    stages = dict()
+    counters = dict()
+    for name, value in self.data.items():
+      if name.startswith('#'):
+        counters[name[1:]] = value
+      else:
+        stages[name] = {'calls': value[0], 'seconds': value[1]}
+    return {'stages': stages, 'counters': counters}
+
+
+def render_prometheus() -> str:
+  """
+  All collected metrics in the Prometheus text exposition format.
+  """
+
+  with _lock:
+    stages = dict(_stages)
+    counters = dict(_counters)
+
+  lines = [
+    '# HELP robotrader_stage_seconds_total Time spent in each stage.',
+    '# TYPE robotrader_stage_seconds_total counter',
+  ]
+  lines += ['robotrader_stage_seconds_total{stage="%s"} %.9f' % (name, seconds)
+            for name, (calls, seconds) in sorted(stages.items())]
+  lines += [
+    '# HELP robotrader_stage_calls_total Number of times each stage ran.',
+    '# TYPE robotrader_stage_calls_total counter',
+  ]
+  lines += ['robotrader_stage_calls_total{stage="%s"} %d' % (name, calls)
+            for name, (calls, seconds) in sorted(stages.items())]
+  lines += [
+    '# HELP robotrader_events_total Number of processed items per kind.',
+    '# TYPE robotrader_events_total counter',
+  ]
+  lines += ['robotrader_events_total{event="%s"} %d' % (name, value) for name, value in sorted(counters.items())]
+
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import market_data
+import ledger
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def price_matrix(tickers : list[str], dates, field='Adj Close') -> np.ndarray:
+  """
+  Dates x tickers matrix of a price field, carrying the last known price over days without a bar.
+  """
+
+  index = pd.DatetimeIndex(np.asarray(dates, dtype='datetime64[D]'))
+  prices = np.full((len(index), len(tickers)), np.nan)
+
+  if len(index) == 0:
+    return prices
+
+  for j, ticker in enumerate(tickers):
+    data = market_data.get_history(ticker, start=index[0], end=index[-1] + pd.Timedelta(days=1))
+    prices[:, j] = data[field].reindex(index).ffill().values
+
+  return prices
+
+def holdings_matrix(transactions : ledger.Ledger, dates) -> tuple[np.ndarray, np.ndarray]:
+  """
+  Shares held of every ledger ticker at the end of each day (dates x tickers) and the cash flow of
+  each day, both built from the ledger in one vectorized pass.
+  """
+
+  dates = np.asarray(dates, dtype='datetime64[D]')
+  records = transactions.records
+
+  day = np.searchsorted(dates, records['date'])
+  is_buy = records['kind'] == ledger.BUY
+
+  # Buys add shares and spend cash, sales remove shares and bring cash in
+  shares = np.where(is_buy, records['amount'], -records['amount'])
+  cash_flow = np.where(is_buy, -records['amount']*records['buy_price'], records['amount']*records['sell_price'])
+
+  changes = np.zeros((len(dates), len(transactions.tickers)), dtype=np.int64)
+  np.add.at(changes, (day, records['ticker']), shares)
+
+  return np.cumsum(changes, axis=0), np.bincount(day, weights=cash_flow, minlength=len(dates))
+
+def equity_curve(transactions : ledger.Ledger, dates, starting_balance : float, prices=None) -> pd.DataFrame:
+  """
+  Daily mark-to-market value of a backtest: cash plus every open position valued at that day's
+  (adjusted) close. prices is an optional dates x ledger tickers matrix, loaded from the market
+  data provider when not given.
+  """
+
+  dates = np.asarray(dates, dtype='datetime64[D]')
+  holdings, cash_flow = holdings_matrix(transactions, dates)
+  if prices is None:
+    prices = price_matrix(transactions.tickers, dates)
+
+  cash = starting_balance + np.cumsum(cash_flow)
+  invested = np.where(holdings != 0, holdings*np.nan_to_num(prices), 0.0).sum(axis=1)
+  equity = cash + invested
+  drawdown = equity/np.maximum.accumulate(equity) - 1
+
+  return pd.DataFrame({'cash': cash, 'invested': invested, 'equity': equity, 'drawdown': drawdown},
+                      index=pd.DatetimeIndex(dates, name='Date'))
+
+def risk_metrics(curve : pd.DataFrame) -> dict:
+  """
+  Summary statistics of an equity curve. Volatility and Sharpe ratio are annualized from daily
+  returns, the Sharpe ratio assumes a risk free rate of zero.
+  """
+
+  equity = curve['equity'].values
+  returns = equity[1:]/equity[:-1] - 1 if len(equity) > 1 else np.array([])
+
+  volatility = returns.std(ddof=1)*np.sqrt(TRADING_DAYS_PER_YEAR) if len(returns) > 1 else 0.0
+  sharpe = returns.mean()/returns.std(ddof=1)*np.sqrt(TRADING_DAYS_PER_YEAR) \
+    if len(returns) > 1 and returns.std(ddof=1) > 0 else 0.0
+
+  return {
+    'total_return_pct': (equity[-1]/equity[0] - 1)*100 if len(equity) else 0.0,
+    'max_drawdown_pct': curve['drawdown'].min()*100 if len(equity) else 0.0,
+    'annualized_volatility_pct': volatility*100,
+    'sharpe_ratio': sharpe,
+  }
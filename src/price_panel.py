@@ -0,0 +1,207 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import market_data
+import metrics
+
+FIELDS = ('High', 'Low', 'Close')
+
+
+class PanelHandle(NamedTuple):
+  """
+  Picklable description of a panel in shared memory (name) or in a memory mapped file (path), all a
+  worker process needs to attach to it.
+  """
+  name: str
+  path: str
+  dtype: str
+  tickers: list
+  dates: np.ndarray
+  fields: tuple
+
+
+class PricePanel:
+  """
+  Bars of a ticker universe as one contiguous array of shape (fields, dates, tickers), so every
+  field is a dates x tickers matrix the batched kernels of supertrend and macd_analysis take as is.
+  Dates are the union of the tickers' bar dates, days a ticker has no bar are NaN.
+  Values are stored as float64, or as float32 to halve the memory of universe scale runs, see
+  analysis.panel_precision for what that costs in signal accuracy. Panels can be placed in shared
+  memory (share) or a memory mapped file (save), worker processes attach to them without copying.
+  """
+
+  def __init__(self, tickers : list[str], dates : np.ndarray, fields : tuple, values : np.ndarray, _owner=None):
+    self.tickers = list(tickers)
+    self.dates = np.asarray(dates, dtype='datetime64[D]')
+    self.fields = tuple(fields)
+    self.values = values
+    self._columns = {ticker: j for j, ticker in enumerate(self.tickers)}
+    # Keeps the shared memory block or mapped file of the values alive
+    self._owner = _owner
+
+  @classmethod
+  @metrics.timed('data_fetch')
+  def load(cls, tickers : list[str], start=None, end=None, fields=FIELDS, interval='1d', dtype=np.float64,
+           workers=8):
+    """
+    Retrieve the bars of many tickers for [start, end) into a panel. Unlike market_data.get_panel no
+    per field frames are concatenated, each history is written into its column of the array directly.
+    """
+
+    tickers = list(tickers)
+    fetch = lambda ticker: market_data.get_history(ticker, start=start, end=end, interval=interval)
+    if workers > 1 and len(tickers) > 1:
+      with ThreadPoolExecutor(max_workers=workers) as pool:
+        histories = list(pool.map(fetch, tickers))
+    else:
+      histories = [fetch(ticker) for ticker in tickers]
+
+    days = [data.index.values.astype('datetime64[D]') for data in histories]
+    dates = np.unique(np.concatenate(days)) if days else np.array([], dtype='datetime64[D]')
+
+    values = np.full((len(fields), len(dates), len(tickers)), np.nan, dtype=dtype)
+    for j, data in enumerate(histories):
+      rows = np.searchsorted(dates, days[j])
+      for f, field in enumerate(fields):
+        values[f, rows, j] = data[field].values
+
+    return cls(tickers, dates, fields, values)
+
+  @classmethod
+  def from_frames(cls, frames : dict, dtype=np.float64):
+    """
+    Build a panel from the field -> dates x tickers frames of market_data.get_panel.
+    """
+
+    fields = tuple(frames)
+    first = frames[fields[0]]
+    values = np.stack([frames[field].reindex(index=first.index, columns=first.columns).values for field in fields])
+    return cls(list(first.columns), first.index.values, fields, values.astype(dtype, copy=False))
+
+  @property
+  def dtype(self) -> np.dtype:
+    return self.values.dtype
+
+  @property
+  def nbytes(self) -> int:
+    return self.values.nbytes
+
+  def __getitem__(self, field : str) -> np.ndarray:
+    """
+    The dates x tickers matrix of a field, a view of the panel.
+    """
+    return self.values[self.fields.index(field)]
+
+  def frame(self, field : str) -> pd.DataFrame:
+    """
+    A field as a dates x tickers frame, like the frames of market_data.get_panel.
+    """
+    return pd.DataFrame(self[field], index=pd.DatetimeIndex(self.dates, name='Date'), columns=self.tickers,
+                        copy=False)
+
+  def column(self, ticker : str) -> int:
+    return self._columns[ticker]
+
+  def select(self, start : int, stop : int):
+    """
+    The panel of the tickers in columns [start, stop), a view sharing the values.
+    """
+    return PricePanel(self.tickers[start:stop], self.dates, self.fields, self.values[:, :, start:stop], self._owner)
+
+  def astype(self, dtype):
+    return PricePanel(self.tickers, self.dates, self.fields, self.values.astype(dtype))
+
+  def share(self):
+    """
+    Copy the panel into a new shared memory block. Returns the panel backed by the block and the
+    handle workers attach with. The block lives until the returned panel's close(unlink=True).
+    """
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, self.values.nbytes))
+    values = np.ndarray(self.values.shape, dtype=self.values.dtype, buffer=block.buf)
+    values[...] = self.values
+
+    panel = PricePanel(self.tickers, self.dates, self.fields, values, block)
+    return panel, PanelHandle(block.name, None, self.values.dtype.str, self.tickers, self.dates, self.fields)
+
+  def save(self, path : str) -> PanelHandle:
+    """
+    Write the panel to a directory, values as a .npy file that attach maps into memory read only.
+    """
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'values.npy'), self.values)
+    np.save(os.path.join(path, 'dates.npy'), self.dates)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+      json.dump({'tickers': self.tickers, 'fields': self.fields}, f)
+    return PanelHandle(None, path, self.values.dtype.str, self.tickers, self.dates, self.fields)
+
+  def close(self, unlink=False):
+    """
+    Detach from the shared memory block backing the panel, unlink=True also frees the block.
+    """
+
+    if isinstance(self._owner, shared_memory.SharedMemory):
+      self.values = None
+      self._owner.close()
+      if unlink:
+        self._owner.unlink()
+    self._owner = None
+
+
+def attach(handle : PanelHandle) -> PricePanel:
+  """
+  Attach to a panel another process shared or saved, without copying its values. Panels in a file
+  are mapped read only.
+  """
+
+  shape = (len(handle.fields), len(handle.dates), len(handle.tickers))
+  if handle.name is None:
+    return open_panel(handle.path)
+
+  block = shared_memory.SharedMemory(name=handle.name)
+  values = np.ndarray(shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+  return PricePanel(handle.tickers, handle.dates, handle.fields, values, block)
+
+def open_panel(path : str) -> PricePanel:
+  """
+  Map a panel written by PricePanel.save into memory, read only.
+  """
+
+  with open(os.path.join(path, 'meta.json')) as f:
+    meta = json.load(f)
+  dates = np.load(os.path.join(path, 'dates.npy'))
+  values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+  return PricePanel(meta['tickers'], dates, tuple(meta['fields']), values, values)
+
+
+if __name__ == "__main__":
+  import argparse
+  import analysis
+  from ticker_universe import DEFAULT_UNIVERSE, read_tickers
+
+  parser = argparse.ArgumentParser(description='Report the memory of a price panel and the float32 precision check.')
+  parser.add_argument('--tickers', default=DEFAULT_UNIVERSE, help='Universe file with one symbol per line')
+  parser.add_argument('--synthetic', type=int, default=None, help='Use a synthetic universe of this size instead')
+  parser.add_argument('--start', default='2004-01-01')
+  parser.add_argument('--end', default='2024-01-01')
+  args = parser.parse_args()
+
+  if args.synthetic:
+    import synthetic
+    market_data.set_provider(synthetic.SyntheticProvider())
+    names = synthetic.universe(args.synthetic)
+  else:
+    names = read_tickers(args.tickers)
+
+  panel = PricePanel.load(names, args.start, args.end)
+  report = analysis.panel_precision(panel)
+  print('%d tickers x %d dates, %d bars' % (len(panel.tickers), len(panel.dates), report['bars']))
+  print('float64 %.1f MB, float32 %.1f MB' % (report['float64_bytes'] / 2**20, report['float32_bytes'] / 2**20))
+  print('max relative price error %.2e' % report['max_relative_price_error'])
+  print('signal mismatches: %d buy, %d sell (rate %.2e)' % (report['buy_mismatches'], report['sell_mismatches'],
+                                                          report['mismatch_rate']))
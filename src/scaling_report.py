@@ -0,0 +1,56 @@
+import argparse
+import time
+import numpy as np
+import simulator as sim
+import signals
+import trend_cache
+from ticker_universe import DEFAULT_UNIVERSE, read_tickers
+
+def scaling_report(tickers : list[str], start_date : str, end_date : str, worker_counts=(1, 2, 4, 8)) -> list[dict]:
+  """
+  Time the precompute signal generation of a backtest for each worker count. Every run is checked
+  to produce exactly the same signal matrices as the single worker run. The trend cache is turned
+  off, it would otherwise time reads of the first run's results and fill the user's cache directory.
+  """
+
+  with trend_cache.disabled():
+    trading_days = sim.get_trading_days(start_date, end_date)
+
+    # Fill the market data store first so every run measures computation only
+    signals.compute_signals(tickers, trading_days)
+
+    report = []
+    reference = None
+    for workers in worker_counts:
+      start = time.perf_counter()
+      matrix = signals.compute_signals(tickers, trading_days, workers=workers)
+      elapsed = time.perf_counter() - start
+
+      if reference is None:
+        reference = matrix
+      identical = np.array_equal(matrix.buy, reference.buy) and np.array_equal(matrix.sell, reference.sell)
+
+      report.append({'workers': workers, 'seconds': elapsed, 'speedup': report[0]['seconds']/elapsed if report else 1.0,
+                     'identical': identical})
+
+  return report
+
+def format_report(report : list[dict]) -> str:
+  lines = ['workers  seconds  speedup  efficiency  identical']
+  for row in report:
+    lines.append('%7d  %7.2f  %6.2fx  %9.0f%%  %s' % (row['workers'], row['seconds'], row['speedup'],
+                                                      100*row['speedup']/row['workers'], row['identical']))
+  return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Compare parallel signal generation across worker counts.')
+  parser.add_argument('--tickers', default=DEFAULT_UNIVERSE)
+  parser.add_argument('--limit', type=int, default=None, help='Only use the first N tickers')
+  parser.add_argument('--start', default='2019-01-01')
+  parser.add_argument('--end', default='2020-12-31')
+  parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+  args = parser.parse_args()
+
+  tickers = read_tickers(args.tickers)[:args.limit]
+  print(format_report(scaling_report(tickers, args.start, args.end, args.workers)))
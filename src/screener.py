@@ -0,0 +1,78 @@
+import argparse
+import numpy as np
+import pandas as pd
+import analysis
+import metrics
+import price_panel
+import signals
+import trading_calendar
+from ticker_universe import DEFAULT_UNIVERSE, read_tickers
+
+
+@metrics.timed('screen')
+def screen(tickers=None, date=None, constants=None, macd=(12, 26, 9), workers=8, dtype=np.float64) -> dict:
+  """
+  Find the tickers of a universe with a buy or sell signal for trading on the given date (default
+  today). Like simulator.simulate_daily_trades, signals come from the close of the previous
+  trading day and a buy signal takes precedence over a sell signal. Nothing is traded.
+  The universe defaults to tickers.txt and is evaluated as one aligned price panel over
+  signals.LOOKBACK_YEARS of history, stored as float64 or, to halve its memory, float32 (see
+  analysis.panel_precision).
+  """
+
+  if tickers is None:
+    tickers = read_tickers(DEFAULT_UNIVERSE)
+  tickers = list(tickers)
+
+  calendar = trading_calendar.get_calendar('NYSE')
+  trading_date = calendar.on_or_before(date if date is not None else pd.Timestamp.today().normalize())
+  signal_date = calendar.previous(trading_date)
+  metrics.count('tickers_screened', len(tickers))
+
+  # Load the universe as one panel
+  end = pd.Timestamp(signal_date) + pd.Timedelta(days=1)
+  panel = price_panel.PricePanel.load(tickers, start=signals.lookback_start(signal_date), end=end, dtype=dtype,
+                                     workers=workers)
+  trend, macd_buy, macd_sell = analysis.panel_signals(panel, constants, macd)
+
+  # Read the signals of the last close
+  row = len(panel.dates) - 1
+  has_bar = np.zeros(len(tickers), dtype=bool)
+  if row >= 0 and panel.dates[row] == np.datetime64(signal_date, 'D'):
+    has_bar = ~np.isnan(panel['Close'][row])
+
+  result = {'trading_date': str(trading_date), 'signal_date': str(signal_date), 'buy': [], 'sell': [],
+            'no_data': [], 'signals': dict()}
+
+  for j, ticker in enumerate(tickers):
+    if not has_bar[j]:
+      result['no_data'].append(ticker)
+      continue
+
+    reading = {'trend': bool(trend[row, j]), 'macd_buy': bool(macd_buy[row, j]), 'macd_sell': bool(macd_sell[row, j])}
+    result['signals'][ticker] = reading
+
+    # Same rules as analysis.signal_masks and simulator.trading_day, a down trend is a sell signal
+    if reading['trend'] or reading['macd_buy']:
+      result['buy'].append(ticker)
+    else:
+      result['sell'].append(ticker)
+
+  return result
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='List the tickers with a buy or sell signal for a trading day.')
+  parser.add_argument('--tickers', default=DEFAULT_UNIVERSE, help='Universe file with one symbol per line')
+  parser.add_argument('--date', default=None, help='Trading day to screen for, today by default')
+  parser.add_argument('--workers', type=int, default=8, help='Threads fetching market data')
+  parser.add_argument('--float32', action='store_true', help='Store the price panel as float32')
+  args = parser.parse_args()
+
+  result = screen(read_tickers(args.tickers), args.date, workers=args.workers,
+                  dtype=np.float32 if args.float32 else np.float64)
+  print('Signals of %s for trading on %s' % (result['signal_date'], result['trading_date']))
+  print('Buy:  ' + ' '.join(result['buy']))
+  print('Sell: ' + ' '.join(result['sell']))
+  if result['no_data']:
+    print('No data: ' + ' '.join(result['no_data']))
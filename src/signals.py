@@ -0,0 +1,450 @@
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import analysis
+import caching
+import market_data
+import indicators
+import trading_calendar
+import metrics
+import price_panel
+import trend_cache
+
+# Amount of history the strategy looks at before the first day it trades on
+LOOKBACK_YEARS = 2
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.robotrader', 'state')
+
+# Tickers per batch of the panel kernels, large enough to keep them vectorised, small enough to
+# report progress every few seconds
+PANEL_BATCH = 256
+
+# Last bars folded into a persisted state that are read again to notice revised history
+CHECK_BARS = 5
+
+
+class SignalMatrix:
+  """
+  Buy and sell signals for a set of tickers, stored as ticker x date boolean matrices aligned to
+  a common array of trading days. Row i of buy/sell belongs to tickers[i], column j to dates[j].
+  A signal on a date is based only on bars up to and including that date's close.
+  Columns are found through the trading calendar ordinal of a date, so lookups are O(1).
+  """
+
+  def __init__(self, tickers : list[str], dates : np.ndarray, buy : np.ndarray, sell : np.ndarray):
+    self.tickers = list(tickers)
+    self.dates = np.asarray(dates, dtype='datetime64[D]')
+    self.buy = buy
+    self.sell = sell
+    self._rows = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    # Column of every trading calendar ordinal covered by the dates, -1 if the date is not a column
+    self.calendar = trading_calendar.get_calendar('NYSE')
+    ordinals = self.calendar.ordinals(self.dates)
+    valid = ordinals >= 0
+    self._first = int(ordinals[valid].min()) if valid.any() else 0
+    self._columns = np.full(int(ordinals.max()) - self._first + 1 if valid.any() else 0, -1, dtype=np.int64)
+    self._columns[ordinals[valid] - self._first] = np.flatnonzero(valid)
+
+  def lookup(self, ticker : str, date) -> tuple[bool, bool]:
+    """
+    Return the (buy, sell) signals of a ticker on a date. Unknown tickers and dates carry no signal.
+    """
+
+    row = self._rows.get(ticker)
+    if row is None:
+      return False, False
+
+    try:
+      i = self.calendar.ordinal(date) - self._first
+    except (KeyError, ValueError):
+      return False, False
+    if not 0 <= i < len(self._columns) or self._columns[i] < 0:
+      return False, False
+    col = self._columns[i]
+
+    return bool(self.buy[row, col]), bool(self.sell[row, col])
+
+
+def pool_context():
+  """
+  Start method of the worker processes of the signal precompute. Forking a process whose other
+  threads, e.g. the API's jobs, may hold locks can deadlock the child, so workers are started from
+  a fresh server process instead, or spawned where that is not available.
+  """
+
+  methods = multiprocessing.get_all_start_methods()
+  return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def lookback_start(start_date) -> pd.Timestamp:
+  """
+  First date of history needed to trade from start_date on.
+  """
+  return pd.Timestamp(start_date) - pd.DateOffset(years=LOOKBACK_YEARS)
+
+def ticker_signals(ticker : str, start_date, end_date):
+  """
+  Run the strategy once over all bars of a ticker in [start_date, end_date) and return its buy and
+  sell masks indexed by date. The analysis comes from the on-disk trend_cache when it is enabled, so
+  a backtest over a range seen before only analyses the bars added since.
+  """
+
+  if trend_cache.enabled():
+    trend_analysis = trend_cache.get_trend_cache().trend_analysis(ticker, start_date, end_date)
+  else:
+    data = market_data.get_history(ticker, start=start_date, end=end_date)
+    trend_analysis = analysis.analyze_data(data) if len(data) else None
+
+  if trend_analysis is None or len(trend_analysis) == 0:
+    empty = pd.Series(dtype=bool, index=pd.DatetimeIndex([]))
+    return empty, empty
+
+  return analysis.signal_masks(trend_analysis)
+
+def align(masks : list[pd.Series], dates : np.ndarray) -> np.ndarray:
+  """
+  Stack per-ticker masks into a ticker x date matrix over the given days, days without a bar are False.
+  """
+
+  index = pd.DatetimeIndex(np.asarray(dates, dtype='datetime64[D]'))
+  matrix = np.zeros((len(masks), len(index)), dtype=bool)
+
+  for i, mask in enumerate(masks):
+    matrix[i] = mask.reindex(index, fill_value=False).values
+
+  return matrix
+
+def _ticker_rows(ticker : str, start, end, dates : np.ndarray):
+  """
+  Worker task: signals of one ticker aligned to the trading days, as a pair of boolean rows.
+  """
+
+  buy_mask, sell_mask = ticker_signals(ticker, start, end)
+  return align([buy_mask], dates)[0], align([sell_mask], dates)[0]
+
+@metrics.timed('signal_precompute')
+def compute_signals(tickers : list[str], trading_days, workers=1, progress=None) -> SignalMatrix:
+  """
+  Precompute the signals of every ticker for every trading day in one pass per ticker.
+  Each ticker is analysed over the whole backtest range plus LOOKBACK_YEARS of warm up history,
+  the same amount of history the per-day evaluation sees, by which point the EMA and ATR seeds
+  have decayed below double precision. Both indicators are causal, so extending the range forward
+  never changes the reading on an earlier day.
+  With workers > 1 the tickers are spread over a process pool. Rows are collected in ticker order,
+  so the result does not depend on the number of workers.
+  progress is called as progress(tickers_done, tickers_total) after every ticker, an exception it
+  raises stops the computation.
+  """
+
+  metrics.count('tickers_precomputed', len(tickers))
+
+  dates = np.asarray(trading_days, dtype='datetime64[D]')
+  start = lookback_start(dates[0])
+  end = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1)
+
+  buy = np.zeros((len(tickers), len(dates)), dtype=bool)
+  sell = np.zeros((len(tickers), len(dates)), dtype=bool)
+
+  if workers > 1 and len(tickers) > 1:
+    # Workers use the same market data provider as this process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=market_data.set_provider,
+                             initargs=(market_data.get_provider(),)) as pool:
+      n = len(tickers)
+      rows = pool.map(_ticker_rows, tickers, [start]*n, [end]*n, [dates]*n,
+                      chunksize=max(1, n // (4*workers)))
+      try:
+        for i, (buy_row, sell_row) in enumerate(rows):
+          buy[i], sell[i] = buy_row, sell_row
+          if progress:
+            progress(i + 1, n)
+      except BaseException:
+        # Drop the tickers not started yet instead of waiting for them
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+  else:
+    for i, ticker in enumerate(tickers):
+      buy[i], sell[i] = _ticker_rows(ticker, start, end, dates)
+      if progress:
+        progress(i + 1, len(tickers))
+
+  return SignalMatrix(tickers, dates, buy, sell)
+
+def _panel_rows(panel : price_panel.PricePanel, dates : np.ndarray):
+  """
+  Signals of every ticker of a panel aligned to the trading days, as ticker x date boolean matrices.
+  """
+
+  trend, macd_buy, macd_sell = analysis.panel_signals(panel)
+  present = ~np.isnan(panel['Close'])
+
+  # Same rules as analysis.signal_masks, on the days a ticker has a bar
+  buy_panel = (trend | macd_buy) & present
+  sell_panel = (~trend | macd_sell) & present
+
+  rows = np.minimum(np.searchsorted(panel.dates, dates), max(len(panel.dates) - 1, 0))
+  found = (panel.dates[rows] == dates) if len(panel.dates) else np.zeros(len(dates), dtype=bool)
+
+  buy = np.zeros((len(panel.tickers), len(dates)), dtype=bool)
+  sell = np.zeros((len(panel.tickers), len(dates)), dtype=bool)
+  buy[:, found] = buy_panel[rows[found]].T
+  sell[:, found] = sell_panel[rows[found]].T
+  return buy, sell
+
+# Panels attached by a pool worker, by shared memory name or file path
+_attached = dict()
+
+def _shared_panel_rows(handle : price_panel.PanelHandle, start : int, stop : int, dates : np.ndarray):
+  """
+  Worker task: signals of the tickers in columns [start, stop) of a shared panel.
+  """
+
+  key = handle.name or handle.path
+  if key not in _attached:
+    _attached[key] = price_panel.attach(handle)
+  return _panel_rows(_attached[key].select(start, stop), dates)
+
+@metrics.timed('signal_precompute')
+def compute_panel_signals(tickers : list[str], trading_days, workers=1, dtype=np.float64, progress=None) -> SignalMatrix:
+  """
+  compute_signals for universe scale runs. The history is loaded once into a price_panel.PricePanel,
+  evaluated in batches of tickers rather than ticker by ticker, and with workers > 1 placed in shared
+  memory so the pool's workers read their share of the tickers without a copy of the prices.
+  With the default float64 panel the result equals compute_signals. A float32 panel takes half
+  the memory, see analysis.panel_precision for its effect on the signals.
+  progress is called as progress(tickers_done, tickers_total) after every batch of up to
+  PANEL_BATCH tickers, an exception it raises stops the computation.
+  """
+
+  metrics.count('tickers_precomputed', len(tickers))
+
+  dates = np.asarray(trading_days, dtype='datetime64[D]')
+  start = lookback_start(dates[0])
+  end = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1)
+  panel = price_panel.PricePanel.load(tickers, start=start, end=end, dtype=dtype)
+
+  # Contiguous slices of tickers, at least one per worker
+  n = len(tickers)
+  batches = max(min(workers, n), -(-n // PANEL_BATCH), 1)
+  bounds = np.linspace(0, n, batches + 1).astype(int)
+
+  buy = np.zeros((n, len(dates)), dtype=bool)
+  sell = np.zeros((n, len(dates)), dtype=bool)
+
+  if workers <= 1 or n <= 1:
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+      buy[lo:hi], sell[lo:hi] = _panel_rows(panel.select(lo, hi), dates)
+      if progress:
+        progress(hi, n)
+    return SignalMatrix(tickers, dates, buy, sell)
+
+  shared, handle = panel.share()
+  del panel
+  try:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+      rows = pool.map(_shared_panel_rows, [handle]*batches, bounds[:-1], bounds[1:], [dates]*batches)
+      try:
+        for lo, hi, (buy_rows, sell_rows) in zip(bounds[:-1], bounds[1:], rows):
+          buy[lo:hi], sell[lo:hi] = buy_rows, sell_rows
+          if progress:
+            progress(hi, n)
+      except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+  finally:
+    shared.close(unlink=True)
+
+  return SignalMatrix(tickers, dates, buy, sell)
+
+
+class StateStore:
+  """
+  Directory of persisted indicators.StrategyState objects, one JSON file per ticker and set of
+  strategy parameters. Each state is saved with the date of the first of its last folded bars and
+  a fingerprint of the bars from there on, see LiveSignals.state.
+  """
+
+  def __init__(self, directory=None, params=indicators.STRATEGY_PARAMS):
+    self.directory = directory or os.environ.get('ROBOTRADER_STATE_DIR', DEFAULT_STATE_DIR)
+    self.params = params
+
+  def _path(self, ticker : str) -> str:
+    key = hashlib.blake2b(repr(self.params).encode(), digest_size=8).hexdigest()
+    return os.path.join(self.directory, '%s.%s.json' % (ticker.replace('/', '_'), key))
+
+  def load(self, ticker : str):
+    """
+    Return the saved (state, check date, fingerprint) of a ticker, or None.
+    """
+
+    try:
+      with open(self._path(ticker)) as f:
+        saved = json.load(f)
+      return indicators.StrategyState.from_dict(saved['state']), saved['since'], saved['fingerprint']
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+  def save(self, ticker : str, state : indicators.StrategyState, since : str, data_fingerprint : str):
+    os.makedirs(self.directory, exist_ok=True)
+
+    # Named per writer so concurrent processes do not move each other's file
+    tmp = self._path(ticker) + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+    with open(tmp, 'w') as f:
+      json.dump({'state': state.to_dict(), 'since': since, 'fingerprint': data_fingerprint}, f)
+    os.replace(tmp, self._path(ticker))
+
+
+def advance(state : indicators.StrategyState, data : pd.DataFrame) -> indicators.StrategyState:
+  """
+  Fold the bars of a frame that are newer than the state into it.
+  """
+
+  if state.last_date is not None:
+    data = data.loc[data.index > pd.Timestamp(state.last_date)]
+
+  for date, high, low, close in zip(data.index, data['High'].values, data['Low'].values, data['Close'].values):
+    state.update(str(date.date()), high, low, close)
+
+  return state
+
+
+class LiveSignals:
+  """
+  Signals for live trading backed by persisted streaming indicator state. Looking up a ticker only
+  fetches the bars since its state was last saved and folds them in, a ticker without state is
+  warmed up over LOOKBACK_YEARS of history first.
+  """
+
+  params = indicators.STRATEGY_PARAMS
+
+  def __init__(self, store=None):
+    self.store = store if store is not None else StateStore(params=self.params)
+
+  @metrics.timed('live_signals')
+  def state(self, ticker : str, date) -> indicators.StrategyState:
+    """
+    Return the strategy state of a ticker advanced up to and including the given date.
+    The last CHECK_BARS bars a saved state was built on are read again with the new ones. If they
+    were revised since, e.g. adjusted for a split, the state is warmed up again from scratch, its
+    averages and bands would otherwise mix prices from before and after the revision.
+    """
+
+    day = pd.Timestamp(date)
+    end = day + pd.Timedelta(days=1)
+    saved = self.store.load(ticker)
+    state, data = None, None
+
+    # State from the future cannot be rewound, recompute without replacing it
+    persist = True
+    if saved is not None and pd.Timestamp(saved[0].last_date) > day:
+      saved = None
+      persist = False
+
+    if saved is not None:
+      state, since, data_fingerprint = saved
+      data = market_data.get_history(ticker, start=since, end=end)
+      if trend_cache.fingerprint(data.loc[data.index <= pd.Timestamp(state.last_date)]) != data_fingerprint:
+        metrics.count('live_state_revisions')
+        state = None
+
+    if state is None:
+      state = indicators.StrategyState(*self.params)
+      data = market_data.get_history(ticker, start=lookback_start(day), end=end)
+
+    last_date = state.last_date
+    advance(state, data)
+
+    if persist and state.last_date != last_date:
+      checked = data.loc[data.index <= pd.Timestamp(state.last_date)].iloc[-CHECK_BARS:]
+      self.store.save(ticker, state, str(checked.index[0].date()), trend_cache.fingerprint(checked))
+
+    return state
+
+  def lookup(self, ticker : str, date) -> tuple[bool, bool]:
+    """
+    Return the (buy, sell) signals of a ticker on a date, no signal if there is no bar on that date.
+    """
+
+    signals = self.signals(ticker, date)
+    return signals if signals is not None else (False, False)
+
+  def signals(self, ticker : str, date):
+    """
+    Return the (buy, sell) signals of a ticker on a date, or None if there is no bar on that date
+    (yet, the bar of the day may still be published later).
+    """
+
+    state = self.state(ticker, date)
+    if state.last_date != str(pd.Timestamp(date).date()):
+      return None
+    return state.buy, state.sell
+
+
+class SignalCache:
+  """
+  Signals shared by concurrent live trading requests, keyed by (ticker, date, strategy parameters).
+  Concurrent lookups of the same key share one computation by the underlying source (LiveSignals by
+  default) and later lookups are answered from memory. At most maxsize results are kept, and all
+  of them are dropped once lookups move on to a later date, i.e. when a new trading day starts.
+  Lookups finding no bar on their date are not kept, so a bar published later is picked up.
+  """
+
+  def __init__(self, source=None, maxsize=4096):
+    self.source = source if source is not None else LiveSignals()
+    self._results = caching.LRUCache(maxsize)
+    self._flight = caching.SingleFlight()
+    self._day = None
+    self._lock = threading.Lock()
+
+  def _roll(self, day : str):
+    with self._lock:
+      if self._day is None or day > self._day:
+        if self._day is not None:
+          self._results.clear()
+        self._day = day
+
+  def lookup(self, ticker : str, date) -> tuple[bool, bool]:
+    """
+    Return the (buy, sell) signals of a ticker on a date, see LiveSignals.lookup.
+    """
+
+    day = str(pd.Timestamp(date).date())
+    self._roll(day)
+    key = (ticker, day, getattr(self.source, 'params', None))
+
+    result = self._results.get(key)
+    if result is not None:
+      metrics.count('signal_cache_hits')
+      return result
+
+    return self._flight.do(key, lambda: self._compute(key, ticker, day))
+
+  def _compute(self, key, ticker : str, day : str) -> tuple[bool, bool]:
+    # Another caller may have finished this key between the cache check and the flight starting
+    result = self._results.get(key)
+    if result is None:
+      metrics.count('signal_cache_misses')
+      result = self.source.signals(ticker, day)
+      if result is None:
+        return False, False
+      self._results.set(key, result)
+    return result
+
+
+_signal_cache = None
+_signal_cache_lock = threading.Lock()
+
+def get_signal_cache() -> SignalCache:
+  """
+  Return the process wide signal cache of live trading, creating it on first use.
+  """
+
+  global _signal_cache
+  with _signal_cache_lock:
+    if _signal_cache is None:
+      _signal_cache = SignalCache()
+    return _signal_cache
@@ -1,32 +1,22 @@
 import analysis
 import datetime
-import yfinance as yf
+import market_data
+import signals as sig
+import ledger
 import numpy as np
-import pandas_market_calendars as mcal
+import trading_calendar
 import pandas as pd
+import metrics
 
+@metrics.timed('calendar')
 def get_trading_days(start_date : str, end_date : str) -> np.ndarray:
   """
   Retrieve all valid Tradings days on the New York Stock Exchange between the given
-  start date and end date. Return as Numpy Array.
+  start date and end date. Return as Numpy Array of 'YYYY-MM-DD' strings.
   """
 
-  # Initialize NYSE Calendar
-  nyse = mcal.get_calendar('NYSE')
-
-  # Format Date Range
-  schedule = nyse.schedule(start_date=start_date, end_date=end_date)
-  date_range = mcal.date_range(schedule, frequency='1D')
-
-  # Convert to Numpy Array
-  date_series = pd.Series(date_range.format())
-  days = np.asarray(date_series)
-
-  # Truncate the Date strings to 'YYYY-MM-DD'
-  for i in range(len(days)):
-    days[i] = days[i][:10]
-  
-  return days
+  days = trading_calendar.get_calendar('NYSE').trading_days(start_date, end_date)
+  return np.datetime_as_string(days, unit='D').astype(object)
 
 def generate_sale_transaction(ticker : str, date : str, amount : int, sell_price : float, buy_price : float) -> dict:
     """
@@ -45,11 +35,38 @@ def generate_buy_transaction(ticker : str, date : str, amount : int, buy_price :
 
     return {'ticker': ticker, 'date': date, 'amount': amount, 'buy_price': buy_price}
 
-def enter_positions(tickers : list[str], date : str, balance : float, positions : dict, logs : list[dict], backtest=False) -> float:
+def record_buy(logs, ticker : str, date : str, amount : int, buy_price : float):
+    """
+    Log a buy in either a ledger.Ledger or a list of transaction dicts and return the resulting open position.
+    Backtests use the ledger, the API passes its JSON transaction list.
+    """
+
+    if isinstance(logs, ledger.Ledger):
+        logs.add_buy(ticker, date, amount, buy_price)
+        return ledger.Lot(ticker, date, amount, buy_price)
+
+    log = generate_buy_transaction(ticker, date, amount, buy_price)
+    logs.append(log)
+    return log
+
+def record_sale(logs, ticker : str, date : str, amount : int, sell_price : float, buy_price : float):
+    """
+    Log a sale in either a ledger.Ledger or a list of transaction dicts.
+    """
+
+    if isinstance(logs, ledger.Ledger):
+        logs.add_sale(ticker, date, amount, sell_price, buy_price)
+    else:
+        logs.append(generate_sale_transaction(ticker, date, amount, sell_price, buy_price))
+
+@metrics.timed('order_execution')
+def enter_positions(tickers : list[str], date : str, balance : float, positions : dict, logs : list[dict], backtest=False,
+                    prices=None) -> float:
     """
     Make an Investment in the passed stock. Portion of balance will be allocated to the purchase.
     If backtesting, the opening price on the purchase date will be used.
     Otherwise, we use the current market price at the time of the transaction.
+    prices optionally maps tickers to execution prices resolved up front, see resolve_prices.
     """
 
     if len(tickers) == 0:
@@ -69,9 +86,12 @@ def enter_positions(tickers : list[str], date : str, balance : float, positions
         except:
             buy_positions = []
 
+        # Use the price resolved for the whole trading day if we have one
+        if prices and ticker in prices:
+            buy_price = prices[ticker]
         # If not backtesting, retrieve current market price
-        if not backtest:
-            sell_price = analysis.current_price(ticker)
+        elif not backtest:
+            buy_price = analysis.current_price(ticker)
         # If backtesting, retrieve historical opening price
         else:
             buy_price = get_opening_price(ticker, date)
@@ -84,9 +104,7 @@ def enter_positions(tickers : list[str], date : str, balance : float, positions
             
             # Update balance and create transaction log
             new_balance -= amount_to_buy*buy_price
-            log = generate_buy_transaction(ticker, date, amount_to_buy, buy_price)
-            buy_positions.append(log)
-            logs.append(log)
+            buy_positions.append(record_buy(logs, ticker, date, amount_to_buy, buy_price))
 
             # Store active position
             positions[ticker] = buy_positions
@@ -94,7 +112,7 @@ def enter_positions(tickers : list[str], date : str, balance : float, positions
     # Return our balance after all transactions have been made
     return new_balance
 
-def exit_all_positions(date : str, positions : dict, logs : list[dict], backtest=False) -> float:
+def exit_all_positions(date : str, positions : dict, logs : list[dict], backtest=False, price_source=None) -> float:
     """
     Pull all funds out of the market
     """
@@ -103,28 +121,42 @@ def exit_all_positions(date : str, positions : dict, logs : list[dict], backtest
     tickers = list(positions.keys())
 
     # Exit positions and return updated balance
-    return exit_positions(tickers, date, positions, logs, backtest=backtest)
+    prices = resolve_prices(price_source, tickers, date)
+    return exit_positions(tickers, date, positions, logs, backtest=backtest, prices=prices)
+
+@metrics.timed('price_lookup')
+def resolve_prices(price_source, tickers : list[str], date : str) -> dict:
+    """
+    Look up the execution prices of every ticker traded on a date in one call to the price source
+    (market_data.OpeningPrices when backtesting, market_data.QuoteCache when trading live).
+    Tickers the source has no price for are priced individually at execution.
+    """
+
+    if price_source is None or not tickers:
+        return dict()
+    return price_source.prices(tickers, date)
 
 def get_opening_price(ticker : str, date : str) -> float:
     """
     Retrieve the historical opening price of a stock
     """
 
-    ticker_item = yf.Ticker(ticker)
-    
-    # Retrieve History from Yahoo Finance
-    historical = ticker_item.history(period='1w', interval='1d', start=date)
-    
-    # Seperate open prices
-    open_price = historical['Open']
+    # Retrieve the week starting on the given date from the market data provider
+    end = pd.Timestamp(date) + pd.Timedelta(days=7)
+    historical = market_data.get_history(ticker, start=date, end=end)
+
+    # Adjust the open for splits and dividends the same way Yahoo Finance's Ticker.history does
+    open_price = historical['Open'] * (historical['Adj Close'] / historical['Close'])
     # First index will contain price on date as this was the beginning of our search range
-    return open_price[0]
+    return open_price.iloc[0]
 
+@metrics.timed('order_execution')
 def exit_positions(tickers : list[str], date : str, positions : dict, logs : list[dict], 
-                   backtest=False) -> float:
+                   backtest=False, prices=None) -> float:
     """
     Pull out of given stocks and return the amount of funds liquidated by the sale. The sale is logged and
     the profit made on the trade is tracked.
+    prices optionally maps tickers to execution prices resolved up front, see resolve_prices.
     """
 
     liquidated = 0
@@ -138,8 +170,11 @@ def exit_positions(tickers : list[str], date : str, positions : dict, logs : lis
         # If we have open positions, pull out of all of them
         if sell_positions:
 
+            # Use the price resolved for the whole trading day if we have one
+            if prices and ticker in prices:
+                sell_price = prices[ticker]
             # If not backtesting, base the selling price on the current open market price
-            if not backtest:
+            elif not backtest:
                 sell_price = analysis.current_price(ticker)
             # If backtesting, get the opening price on the day of the sale
             else:
@@ -150,8 +185,7 @@ def exit_positions(tickers : list[str], date : str, positions : dict, logs : lis
                 liquidated += sell_price*sell_position['amount']
                 
                 # Create transaction log
-                log = generate_sale_transaction(ticker, date, sell_position['amount'], sell_price, sell_position['buy_price'])
-                logs.append(log)
+                record_sale(logs, ticker, date, sell_position['amount'], sell_price, sell_position['buy_price'])
 
     # Return the amount of funds freed up by this sale
     return liquidated
@@ -160,20 +194,29 @@ def simulate_daily_trades(tickers : list[str], today_date : str, positions : dic
                           balance : float, logs : list[dict]):
     """
     Simulate buy and sell for today's date based on analysis up to closing on the previous trading date.
+    Signals come from persisted indicator state, so only the bars since the last call are processed,
+    and are shared between concurrent requests through the process wide signals.SignalCache.
     """
 
-    dates = get_trading_days('2023-01-01', today_date)
+    calendar = trading_calendar.get_calendar('NYSE')
+    trading_date = calendar.on_or_before(today_date)
+    last_trading_day = calendar.previous(trading_date)
 
-    return trading_day(tickers, dates[-1], dates[-2], positions, balance, logs)
+    return trading_day(tickers, str(trading_date), str(last_trading_day), positions, balance, logs,
+                       signals=sig.get_signal_cache(), price_source=market_data.get_quote_cache())
 
 
+@metrics.timed('trading_day')
 def trading_day(tickers : list[str], today_date : str, last_trading_day : str, positions : dict,
-                balance : float, logs : list[dict], backtest=False) -> float:
+                balance : float, logs : list[dict], backtest=False, signals=None, price_source=None) -> float:
     """
     Execute trading strategy on a Trading Day. Strategy involves calculating buy and sell signals to 
     determine when to buy in to and exit from positions. We calculate trends and decide which stocks
     are giving us which signals. If we receive a buy signal we buy into and if we receive a sell signal
     for a stock we are currently holding, we back out.
+    If a signal source with a lookup(ticker, date) method is passed (signals.SignalMatrix, signals.LiveSignals)
+    it is read instead of evaluating trends. If a price source is passed, the prices of every ticker
+    traded today are resolved from it in one batch.
     This method updates the positions dictionary and log list.
     Returns the updated balance after the day of trading.
     """
@@ -199,31 +242,45 @@ def trading_day(tickers : list[str], today_date : str, last_trading_day : str, p
         print('Date was passed in the wrong format.')
         return
 
+    metrics.count('trading_days')
+    metrics.count('ticker_days', len(tickers))
+
     exit_list = []
     shopping_list = []
 
     # Execute strategy on each stock we would like to trade on
     for ticker in tickers:
 
-        # Evaluate market trends and determine dates on which they tell us to sell or buy
-        trends, buy_dates, sell_dates = analysis.evaluate_trends(ticker, start_date=start_date, end_date=end_date)
-
-        # Check if last trading day is in buy dates
         # Flagged day will be the last trading day if we wish to buy today as the strategy operates on
         # buying as soon as the market opens by analyzing closing prices.
-        if last_trading_day in buy_dates:
+        if signals is not None:
+            buy, sell = signals.lookup(ticker, last_trading_day)
+        else:
+            # Evaluate market trends and determine dates on which they tell us to sell or buy. The
+            # analysis window slides every day, caching it on disk would only churn the trend cache.
+            trends, buy_dates, sell_dates = analysis.evaluate_trends(ticker, start_date=start_date, end_date=end_date,
+                                                                     cache=False)
+            buy = last_trading_day in buy_dates
+            sell = last_trading_day in sell_dates
+
+        # Check if last trading day is in buy dates
+        if buy:
             shopping_list.append(ticker)
             # Do not check for back out if we know we are buying today.
             continue
         
         # Check if last trading day is in the sell dates
-        if last_trading_day in sell_dates:
+        if sell:
             exit_list.append(ticker)
 
+    # Resolve the prices of every position we exit and every stock we buy at once
+    exit_list = [ticker for ticker in exit_list if positions.get(ticker)]
+    prices = resolve_prices(price_source, exit_list + shopping_list, today_date)
+
     # Back out of positions and update balance with freed funds
-    balance += exit_positions(exit_list, today_date, positions, logs, backtest=backtest)
+    balance += exit_positions(exit_list, today_date, positions, logs, backtest=backtest, prices=prices)
     # Enter new positions
-    balance = enter_positions(shopping_list, today_date, balance, positions, logs, backtest=backtest)
+    balance = enter_positions(shopping_list, today_date, balance, positions, logs, backtest=backtest, prices=prices)
 
     # Exit Trading Day, all trades have been completed
     return balance
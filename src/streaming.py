@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import time
+from typing import NamedTuple
+from urllib.parse import urlencode
+import numpy as np
+import pandas as pd
+import market_data
+import indicators
+import intraday
+import metrics
+import signals
+
+
+class Bar(NamedTuple):
+  """
+  One bar of a ticker as delivered by a feed.
+  """
+  ticker: str
+  time: pd.Timestamp
+  high: float
+  low: float
+  close: float
+
+
+class BarFeed:
+  """
+  Source of bars for the streaming signals. Feeds are async iterables of Bar objects in time
+  order, e.g. a broker's live bars or ReplayFeed.
+  """
+
+  def __aiter__(self):
+    raise NotImplementedError
+
+
+class ReplayFeed(BarFeed):
+  """
+  Replays the stored bars of a set of tickers in [start, end) from the market data provider, all
+  tickers' bars of a timestamp together. speed is the replay rate as a multiple of real time, e.g.
+  3600 plays an hour of 1m bars per second; without a speed bars are delivered as fast as they are
+  consumed.
+  """
+
+  def __init__(self, tickers : list[str], start, end, interval='1d', speed=None):
+    self.tickers = list(tickers)
+    self.start = start
+    self.end = end
+    self.interval = interval
+    self.speed = speed
+
+  async def __aiter__(self):
+    panel = await asyncio.to_thread(market_data.get_panel, self.tickers, self.start, self.end, interval=self.interval)
+    high, low, close = (panel[field].values for field in ('High', 'Low', 'Close'))
+    times = panel['Close'].index
+
+    previous = None
+    for i, bar_time in enumerate(times):
+      if self.speed and previous is not None:
+        await asyncio.sleep((bar_time - previous).total_seconds() / self.speed)
+      else:
+        # Let other tasks run between timestamps even at full speed
+        await asyncio.sleep(0)
+      previous = bar_time
+
+      for j in np.flatnonzero(~np.isnan(close[i])):
+        yield Bar(self.tickers[j], bar_time, high[i, j], low[i, j], close[i, j])
+
+
+class SignalEngine:
+  """
+  Incremental signals of many tickers. Every bar is folded into its ticker's
+  indicators.StrategyState, the same computation evaluate_trends performs in batch, and only
+  changes of a ticker's (buy, sell) signals are reported.
+  """
+
+  def __init__(self):
+    self.states = dict()
+    self.signals = dict()
+
+  def warm_up(self, tickers : list[str], until, interval='1d'):
+    """
+    Fold the history before until into the state of every ticker, so the first streamed bar already
+    carries a settled signal: LOOKBACK_YEARS of daily bars, or the last intraday.WARM_UP_BARS bars
+    of shorter intervals, which only reach back a few weeks.
+    """
+
+    start = signals.lookback_start(until)
+    for ticker in tickers:
+      state = indicators.StrategyState(*indicators.STRATEGY_PARAMS)
+      if interval == '1d':
+        signals.advance(state, market_data.get_history(ticker, start=start, end=until))
+      else:
+        # Intraday bars keep their time of day, as in apply
+        data = intraday.recent_bars(ticker, until, interval)
+        for bar_time, high, low, close in zip(data.index, data['High'].values, data['Low'].values, data['Close'].values):
+          state.update(str(bar_time), high, low, close)
+      self.states[ticker] = state
+      self.signals[ticker] = (state.buy, state.sell) if state.last_date is not None else None
+
+  def snapshot(self) -> dict:
+    """
+    Current signals of every ticker that has seen a bar.
+    """
+    return {ticker: {'buy': value[0], 'sell': value[1]} for ticker, value in self.signals.items() if value is not None}
+
+  def apply(self, bar : Bar):
+    """
+    Fold in a bar and return the signal change event it caused, None if the signals stayed the same.
+    """
+
+    state = self.states.get(bar.ticker)
+    if state is None:
+      state = self.states[bar.ticker] = indicators.StrategyState(*indicators.STRATEGY_PARAMS)
+
+    row = state.update(str(bar.time), bar.high, bar.low, bar.close)
+    metrics.count('stream_bars')
+
+    current = (state.buy, state.sell)
+    if current == self.signals.get(bar.ticker):
+      return None
+    self.signals[bar.ticker] = current
+
+    metrics.count('stream_signal_changes')
+    return {'type': 'signal', 'ticker': bar.ticker, 'time': str(bar.time), 'close': float(bar.close),
+            'buy': current[0], 'sell': current[1], 'trend': bool(row['Trend'])}
+
+async def signal_changes(feed : BarFeed, engine : SignalEngine):
+  """
+  Apply every bar of a feed to the engine and yield the signal change events as they happen.
+  """
+
+  async for bar in feed:
+    event = engine.apply(bar)
+    if event is not None:
+      yield event
+
+
+def _percentiles(samples : list[float]) -> dict:
+  if not samples:
+    return {'count': 0, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+  values = np.array(samples) * 1000
+  return {'count': len(samples), 'p50_ms': float(np.percentile(values, 50)), 'p99_ms': float(np.percentile(values, 99)),
+          'max_ms': float(values.max())}
+
+class _TimedFeed(BarFeed):
+  """
+  Wraps a feed and records when each bar arrived. All bars of a timestamp count as arriving with
+  the first of them, so the wait behind the other tickers of that timestamp is part of the latency.
+  """
+
+  def __init__(self, feed : BarFeed):
+    self.feed = feed
+    self.arrivals = dict()
+
+  async def __aiter__(self):
+    current, arrival = None, None
+    async for bar in self.feed:
+      if bar.time != current:
+        current, arrival = bar.time, time.perf_counter()
+      self.arrivals[(bar.ticker, str(bar.time))] = arrival
+      yield bar
+
+def measure_latency(tickers : list[str], start, end, interval='1d', warm_up=True) -> dict:
+  """
+  Latency harness: replay [start, end) for the tickers at full speed and report the bar-to-signal
+  latency percentiles, from a bar leaving the feed to its state being updated (every bar) and to
+  the resulting change event being produced (changes only).
+  """
+
+  engine = SignalEngine()
+  if warm_up:
+    engine.warm_up(tickers, start, interval)
+
+  feed = _TimedFeed(ReplayFeed(tickers, start, end, interval))
+  update_latency = []
+  event_latency = []
+
+  async def run():
+    async for bar in feed:
+      event = engine.apply(bar)
+      elapsed = time.perf_counter() - feed.arrivals.pop((bar.ticker, str(bar.time)))
+      update_latency.append(elapsed)
+      if event is not None:
+        event_latency.append(elapsed)
+
+  start_time = time.perf_counter()
+  asyncio.run(run())
+  seconds = time.perf_counter() - start_time
+
+  return {'tickers': len(tickers), 'bars': len(update_latency), 'seconds': seconds,
+          'bars_per_second': len(update_latency)/seconds if seconds else None,
+          'update': _percentiles(update_latency), 'signal': _percentiles(event_latency)}
+
+def measure_websocket_latency(tickers : list[str], start, end, interval='1d', speed=None) -> dict:
+  """
+  Latency harness over the API: stream the replay through the app's /ws/signals endpoint with an
+  in-process client and report the latency percentiles from a bar leaving the feed to its change
+  event being received. Pace the replay with speed (see ReplayFeed) to a rate the client keeps up
+  with, at full speed the latency mostly measures the backlog of unread messages.
+  """
+
+  from fastapi.testclient import TestClient
+  import main
+
+  arrivals = dict()
+  original_factory = main.feed_factory
+
+  def timed_factory(*args, **kwargs):
+    feed = _TimedFeed(original_factory(*args, **kwargs))
+    feed.arrivals = arrivals
+    return feed
+
+  main.feed_factory = timed_factory
+  latency = []
+  try:
+    with TestClient(main.app) as client:
+      params = {'tickers': ','.join(tickers), 'start': str(start), 'end': str(end), 'interval': interval}
+      if speed:
+        params['speed'] = speed
+      with client.websocket_connect('/ws/signals?' + urlencode(params)) as websocket:
+        while True:
+          event = websocket.receive_json()
+          if event['type'] == 'end':
+            break
+          if event['type'] == 'signal':
+            latency.append(time.perf_counter() - arrivals.pop((event['ticker'], event['time'])))
+  finally:
+    main.feed_factory = original_factory
+
+  return {'tickers': len(tickers), 'signal': _percentiles(latency)}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Measure the bar-to-signal latency of the streaming signals.')
+  parser.add_argument('--tickers', type=int, default=500, help='Size of the synthetic universe')
+  parser.add_argument('--start', default='2024-01-01')
+  parser.add_argument('--end', default='2024-12-31')
+  parser.add_argument('--websocket', action='store_true', help='Also measure through the /ws/signals endpoint')
+  parser.add_argument('--speed', type=float, default=864000,
+                      help='Replay speed of the websocket measurement, the default plays a day every 0.1s')
+  args = parser.parse_args()
+
+  import synthetic
+  market_data.set_provider(synthetic.SyntheticProvider())
+  names = synthetic.universe(args.tickers)
+
+  report = measure_latency(names, args.start, args.end)
+  print('%d tickers, %d bars in %.2fs (%.0f bars/s)' % (report['tickers'], report['bars'], report['seconds'],
+                                                       report['bars_per_second']))
+  for name in ('update', 'signal'):
+    print('%-10s p50 %.3fms  p99 %.3fms  max %.3fms  (%d samples)' % (name, report[name]['p50_ms'],
+          report[name]['p99_ms'], report[name]['max_ms'], report[name]['count']))
+
+  if args.websocket:
+    report = measure_websocket_latency(names, args.start, args.end, speed=args.speed)
+    print('%-10s p50 %.3fms  p99 %.3fms  max %.3fms  (%d samples)' % ('websocket', report['signal']['p50_ms'],
+          report['signal']['p99_ms'], report['signal']['max_ms'], report['signal']['count']))
@@ -1,8 +1,10 @@
 import pandas as pd
-import datetime as dt
-import yfinance as yf
 import numpy as np
-import matplotlib.pyplot as plt
+import metrics
+import visualize as viz
+
+# Default (ATR period, ATR multiplier) pairs of the adjusted supertrend
+CONSTANTS = [(12, 3), (10, 1), (11, 2)]
 
 def calc_HF(high, low):
   return (high + low)/2
@@ -25,102 +27,130 @@ def calc_ATR(high, low, close, atr_period):
 
   return atr
 
-# Generate a super trend reading on the data using the passed constants
-def supertrend(data, atr_period, atr_multiplier):
-  
-  # Parse data for necessary values
-  high = data['High']
-  low = data['Low']
-  close = data['Close']
+# True Range of every bar, computed on raw arrays. Accepts 1-D (bars) or 2-D (bars x tickers) input.
+def calc_TR(high, low, close):
+
+  # Previous close, the first bar has none
+  prev_close = np.empty_like(close)
+  prev_close[0:1] = np.nan
+  prev_close[1:] = close[:-1]
+
+  # max[(high-low), |high — previous close|, |previous close — low|], ignoring the missing previous close
+  tr = np.fmax(high - low, np.abs(high - prev_close))
+  return np.fmax(tr, np.abs(low - prev_close))
+
+# Average True Range of a precomputed True Range array, same smoothing as calc_ATR
+def calc_ATR_from_TR(tr, atr_period):
+  return pd.DataFrame(tr).ewm(alpha=(1/atr_period), min_periods=atr_period).mean().to_numpy().reshape(tr.shape)
+
+# Run the supertrend recursion for several (ATR period, multiplier) pairs at once on raw arrays.
+# high, low and close are 1-D (bars) or 2-D (bars x tickers). The true range is computed once and
+# every distinct ATR period is smoothed once. Returns trend, lower band and upper band arrays of
+# shape (bars, pairs, tickers).
+def supertrend_kernel(high, low, close, constants, atrs=None):
+
+  high = np.asarray(high, dtype=float).reshape(len(high), -1)
+  low = np.asarray(low, dtype=float).reshape(len(low), -1)
+  close = np.asarray(close, dtype=float).reshape(len(close), -1)
+  bars, tickers = close.shape
+  pairs = len(constants)
+
+  # Callers evaluating many parameter sets can share their ATR arrays through atrs
+  if atrs is None:
+    atrs = dict()
+  periods = set(const_tuple[0] for const_tuple in constants) - set(atrs)
+  if periods:
+    tr = calc_TR(high, low, close)
+    for atr_period in periods:
+      atrs[atr_period] = calc_ATR_from_TR(tr, atr_period)
 
-  # Calculate HF value for data
   HF = calc_HF(high, low)
 
-  # Calculate Average True Range for data
-  ATR = calc_ATR(high, low, close, atr_period)
-
-  # Initialize upper band
-  final_upper_band = HF + (atr_multiplier*ATR)
+  # Initialize bands, one column per (pair, ticker)
+  upper = np.empty((bars, pairs, tickers))
+  lower = np.empty((bars, pairs, tickers))
+  for j, (atr_period, atr_multiplier) in enumerate(constants):
+    ATR = atrs[atr_period]
+    upper[:, j] = HF + (atr_multiplier*ATR)
+    lower[:, j] = HF - (atr_multiplier*ATR)
 
-  # Initialize lower band
-  final_lower_band = HF - (atr_multiplier*ATR)
+  upper = upper.reshape(bars, pairs*tickers)
+  lower = lower.reshape(bars, pairs*tickers)
+  close = np.tile(close, (1, pairs))
 
   # Initialize trend reading
-  trend = [True] * len(data)
+  trend = np.ones((bars, pairs*tickers), dtype=bool)
 
-  for i in range(1, len(data.index)):
+  for i in range(1, bars):
 
-    if close[i] > final_upper_band[i-1]:
-      trend[i] = True
-    
-    elif close[i] < final_lower_band[i-1]:
-      trend[i] = False
-    
-    else:
+    up = close[i] > upper[i-1]
+    down = ~up & (close[i] < lower[i-1])
+    keep = ~(up | down)
 
-      trend[i] = trend[i-1]
+    # Keep the previous reading unless the close broke through a band
+    trend[i] = np.where(keep, trend[i-1], up)
 
-      if trend[i] and final_lower_band[i] < final_lower_band[i-1]:
-        final_lower_band[i] = final_lower_band[i-1]
+    # While the trend holds, the active band may only tighten
+    np.copyto(lower[i], lower[i-1], where=keep & trend[i] & (lower[i] < lower[i-1]))
+    np.copyto(upper[i], upper[i-1], where=keep & ~trend[i] & (upper[i] > upper[i-1]))
 
-      if not trend[i] and final_upper_band[i] > final_upper_band[i-1]:
-        final_upper_band[i] = final_upper_band[i-1]
+    upper[i, trend[i]] = np.nan
+    lower[i, ~trend[i]] = np.nan
 
-    if trend[i]:
-      final_upper_band[i] = np.nan
-    else:
-      final_lower_band[i] = np.nan
+  shape = (bars, pairs, tickers)
+  return trend.reshape(shape), lower.reshape(shape), upper.reshape(shape)
 
-  return pd.DataFrame({
-    'Trend': trend,
-    'Lower Band': final_lower_band,
-    'Upper Band': final_upper_band
-  })
-
-def generate_trend(data, visualize=False):
-
-  constants = [(12, 3), (10, 1), (11, 2)]
-  trend_data = []
-  trends = []
-  upper_bands = []
-  lower_bands = []
+# Combine the readings of several supertrends: the trend is up only if all of them agree and the
+# final bands are the average of the active bands. Arrays have shape (bars, pairs, tickers).
+def combine_trends(trend, lower, upper):
 
-  for const_tuple in constants:
-    trend = supertrend(data, atr_period=const_tuple[0], atr_multiplier=const_tuple[1])
-    trend_data.append(trend)
-    trends.append(trend['Trend'])
-    upper_bands.append(trend['Upper Band'])
-    lower_bands.append(trend['Lower Band'])
+  combined = trend.all(axis=1)
 
-  combined_trends = pd.concat(trends, axis=1)
-  combined_trends = combined_trends.all(axis=1)
+  # Average the bands over the pairs that have one, summing in column order
+  bands = []
+  for band in (lower, upper):
+    valid = ~np.isnan(band)
+    total = np.where(valid[:, 0], band[:, 0], 0.0)
+    for j in range(1, band.shape[1]):
+      total += np.where(valid[:, j], band[:, j], 0.0)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      bands.append(np.where(count > 0, total / count, np.nan))
 
-  clb = pd.concat(lower_bands, axis=1)
-  clb = clb.assign(FinalLowerBand=clb.mean(axis=1))
+  final_lower, final_upper = bands
+  final_upper[combined] = np.nan
+  final_lower[~combined] = np.nan
 
-  cub = pd.concat(upper_bands, axis=1)
-  cub = cub.assign(FinalUpperBand=cub.mean(axis=1))
+  return combined, final_lower, final_upper
 
-  final_trend = pd.concat([combined_trends, clb['FinalLowerBand'], cub['FinalUpperBand']], axis=1)
-  final_trend.columns = ['Trend', 'Final Lower Band', 'Final Upper Band']
-
-  final_trend.loc[final_trend['Trend'] == True, 'Final Upper Band'] = np.nan
-  final_trend.loc[final_trend['Trend'] == False, 'Final Lower Band'] = np.nan
+# Generate a super trend reading on the data using the passed constants
+def supertrend(data, atr_period, atr_multiplier):
   
-  if visualize:
-    
-    plt.plot(data['Close'], label='Close Price')
-    plt.plot(final_trend['Final Lower Band'], 'g', label = 'Final Lowerband ')
-    plt.plot(final_trend['Final Upper Band'], 'r', label = 'Final Upperband ')
-
-    plt.show()
-
-  return final_trend
-
+  trend, lower, upper = supertrend_kernel(data['High'].values, data['Low'].values, data['Close'].values,
+                                          [(atr_period, atr_multiplier)])
 
+  return pd.DataFrame({
+    'Trend': trend[:, 0, 0],
+    'Lower Band': lower[:, 0, 0],
+    'Upper Band': upper[:, 0, 0]
+  }, index=data.index)
 
+@metrics.timed('supertrend')
+def generate_trend(data, visualize=False, constants=None):
 
-    
+  if constants is None:
+    constants = CONSTANTS
 
+  trend, lower, upper = supertrend_kernel(data['High'].values, data['Low'].values, data['Close'].values, constants)
+  combined, final_lower, final_upper = combine_trends(trend, lower, upper)
 
+  final_trend = pd.DataFrame({
+    'Trend': combined[:, 0],
+    'Final Lower Band': final_lower[:, 0],
+    'Final Upper Band': final_upper[:, 0]
+  }, index=data.index)
+  
+  if visualize:
+    viz.plot_supertrend(data, final_trend)
 
+  return final_trend
@@ -0,0 +1,159 @@
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+import market_data
+import macd_analysis
+import supertrend
+import simulator as sim
+import signals
+import ledger
+from backtesting import simulate, get_backtest_tickers
+
+
+class TickerIntermediates:
+  """
+  Indicator building blocks of one ticker that are shared by every parameter combination of a sweep:
+  the supertrend reading of each (ATR period, multiplier) pair, which in turn share the true range and
+  ATR per period, and the EMA of the close per span.
+  """
+
+  def __init__(self, data : pd.DataFrame):
+    self.data = data
+    self.atrs = dict()
+    self.pairs = dict()
+    self.emas = dict()
+
+  def supertrend_pairs(self, pairs : list[tuple]):
+    """
+    Run the supertrend recursion once for every pair that has not been evaluated yet.
+    """
+
+    missing = [pair for pair in dict.fromkeys(pairs) if pair not in self.pairs]
+    if not missing:
+      return
+
+    trend, lower, upper = supertrend.supertrend_kernel(self.data['High'].values, self.data['Low'].values,
+                                                       self.data['Close'].values, missing, atrs=self.atrs)
+    for j, pair in enumerate(missing):
+      self.pairs[pair] = (trend[:, j:j+1], lower[:, j:j+1], upper[:, j:j+1])
+
+  def trend(self, constants : list[tuple]) -> np.ndarray:
+    """
+    Combined supertrend reading of a set of pairs, see supertrend.generate_trend.
+    """
+
+    self.supertrend_pairs(constants)
+    readings = [self.pairs[pair] for pair in constants]
+    combined, final_lower, final_upper = supertrend.combine_trends(*(np.concatenate(parts, axis=1)
+                                                                     for parts in zip(*readings)))
+    return combined[:, 0]
+
+  def ema(self, span : int) -> pd.Series:
+    if span not in self.emas:
+      self.emas[span] = macd_analysis.EMA(self.data['Close'], span)
+    return self.emas[span]
+
+  def macd_signals(self, a : int, b : int, c : int):
+    """
+    MACD buy and sell signals, see macd_analysis.evaluate_MACD.
+    """
+
+    MACD_line = self.ema(a) - self.ema(b)
+    signal_line = MACD_line.ewm(span=c, adjust=False).mean()
+    return macd_analysis.crossovers(MACD_line.values, signal_line.values)
+
+
+def parse_supertrend(text : str) -> list[tuple]:
+  """
+  Parse a supertrend parameter set written as 'period:multiplier,period:multiplier,...'.
+  """
+
+  pairs = []
+  for pair in text.split(','):
+    atr_period, atr_multiplier = pair.split(':')
+    pairs.append((int(atr_period), float(atr_multiplier) if '.' in atr_multiplier else int(atr_multiplier)))
+  return pairs
+
+def parse_macd(text : str) -> tuple:
+  """
+  Parse MACD spans written as 'fast:slow:signal'.
+  """
+
+  a, b, c = (int(span) for span in text.split(':'))
+  return a, b, c
+
+def sweep(tickers : list[str], start_date : str, end_date : str, supertrend_grid : list[list[tuple]],
+          macd_grid : list[tuple], starting_balance=100000) -> pd.DataFrame:
+  """
+  Backtest every combination of a supertrend parameter set from supertrend_grid and MACD spans from
+  macd_grid over the same tickers and date range. Data is loaded once per ticker and indicator
+  intermediates are shared between combinations. Returns one row per combination, best return first.
+  """
+
+  trading_days = sim.get_trading_days(start_date, end_date)
+  dates = np.asarray(trading_days, dtype='datetime64[D]')
+  start = signals.lookback_start(dates[0])
+  end = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1)
+
+  combinations = list(itertools.product(supertrend_grid, macd_grid))
+  buy = np.zeros((len(combinations), len(tickers), len(dates)), dtype=bool)
+  sell = np.zeros((len(combinations), len(tickers), len(dates)), dtype=bool)
+
+  for i, ticker in enumerate(tickers):
+    data = market_data.get_history(ticker, start=start, end=end)
+    if len(data) == 0:
+      continue
+
+    shared = TickerIntermediates(data)
+    for k, (constants, macd) in enumerate(combinations):
+      trend = shared.trend(constants)
+      macd_buy, macd_sell = shared.macd_signals(*macd)
+
+      # Same rule as analysis.signal_masks
+      buy_mask = pd.Series(trend | macd_buy, index=data.index)
+      sell_mask = pd.Series(~trend | macd_sell, index=data.index)
+      buy[k, i] = signals.align([buy_mask], dates)[0]
+      sell[k, i] = signals.align([sell_mask], dates)[0]
+
+  # Every combination trades at the same opening prices
+  price_source = market_data.OpeningPrices(tickers, trading_days)
+
+  rows = []
+  for k, (constants, macd) in enumerate(combinations):
+    positions = dict()
+    transaction_log = ledger.Ledger()
+    matrix = signals.SignalMatrix(tickers, dates, buy[k], sell[k])
+
+    balance = simulate(tickers, trading_days, starting_balance, positions, transaction_log, matrix,
+                       price_source=price_source)
+    balance += sim.exit_all_positions(trading_days[-1], positions, transaction_log, backtest=True,
+                                      price_source=price_source)
+
+    rows.append({
+      'supertrend': ','.join('%s:%s' % pair for pair in constants),
+      'macd': '%d:%d:%d' % macd,
+      'final_balance': balance,
+      'return_pct': (balance - starting_balance)/starting_balance*100,
+      'trades': len(transaction_log),
+    })
+
+  table = pd.DataFrame(rows).sort_values('return_pct', ascending=False, kind='stable')
+  return table.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Backtest every combination of strategy parameters.')
+  parser.add_argument('--tickers', nargs='+', default=None)
+  parser.add_argument('--start', default='2019-01-01')
+  parser.add_argument('--end', default='2020-12-31')
+  parser.add_argument('--balance', type=float, default=100000)
+  parser.add_argument('--supertrend', nargs='+', default=['12:3,10:1,11:2'],
+                      help="Supertrend parameter sets, each written as 'period:multiplier,...'")
+  parser.add_argument('--macd', nargs='+', default=['12:26:9'], help="MACD spans written as 'fast:slow:signal'")
+  args = parser.parse_args()
+
+  table = sweep(args.tickers or get_backtest_tickers(), args.start, args.end,
+                [parse_supertrend(text) for text in args.supertrend], [parse_macd(text) for text in args.macd],
+                args.balance)
+  print(table.to_string())
@@ -0,0 +1,60 @@
+import zlib
+import numpy as np
+import pandas as pd
+import market_data
+import trading_calendar
+
+
+def universe(size : int) -> list[str]:
+  """
+  Names of a synthetic ticker universe.
+  """
+  return ['SYN%03d' % i for i in range(size)]
+
+def generate_ohlcv(ticker : str, start_date, end_date, seed=0) -> pd.DataFrame:
+  """
+  Random but reproducible daily bars on the NYSE trading days between start_date and end_date.
+  Closes follow a geometric random walk, opens gap from the previous close and highs/lows extend
+  past both. The same ticker, range and seed always give the same frame.
+  """
+
+  days = trading_calendar.get_calendar('NYSE').trading_days(start_date, end_date)
+  n = len(days)
+  rng = np.random.default_rng([seed, zlib.crc32(ticker.encode())])
+
+  drift = rng.normal(0.0003, 0.0002)
+  volatility = rng.uniform(0.01, 0.03)
+  close = rng.uniform(20, 500) * np.exp(np.cumsum(rng.normal(drift, volatility, n)))
+
+  prev_close = np.concatenate([close[:1], close[:-1]])
+  open_ = prev_close * np.exp(rng.normal(0, volatility/3, n))
+  high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility/2, n)))
+  low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility/2, n)))
+
+  return pd.DataFrame({
+    'Open': open_,
+    'High': high,
+    'Low': low,
+    'Close': close,
+    'Adj Close': close,
+    'Volume': rng.integers(100000, 10000000, n).astype(float),
+  }, index=pd.DatetimeIndex(days, name='Date'))
+
+
+class SyntheticProvider(market_data.MarketDataProvider):
+  """
+  Market data provider serving generate_ohlcv bars, so benchmarks and offline experiments need
+  neither network access nor stored data. Each ticker's history over [start_date, end_date] is
+  generated once and sliced for every request.
+  """
+
+  def __init__(self, start_date='1990-01-01', end_date='2025-12-31', seed=0):
+    self.start_date = start_date
+    self.end_date = end_date
+    self.seed = seed
+    self._frames = dict()
+
+  def history(self, ticker : str, start=None, end=None, interval='1d') -> pd.DataFrame:
+    if ticker not in self._frames:
+      self._frames[ticker] = generate_ohlcv(ticker, self.start_date, self.end_date, self.seed)
+    return market_data.slice_range(self._frames[ticker], start, end)
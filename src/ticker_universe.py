@@ -0,0 +1,12 @@
+import os
+
+# The universe of the API, the screener and the reports, one symbol per line
+DEFAULT_UNIVERSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tickers.txt')
+
+def read_tickers(path=DEFAULT_UNIVERSE) -> list[str]:
+  """
+  Read a ticker universe file with one symbol per line, e.g. tickers.txt.
+  """
+
+  with open(path) as f:
+    return [line.strip() for line in f if line.strip()]
@@ -0,0 +1,203 @@
+import threading
+import numpy as np
+import pandas as pd
+
+# First day covered by the calendar, ordinals count trading days from here
+ORIGIN = np.datetime64('1980-01-01', 'D')
+
+
+def _to_day(date) -> np.datetime64:
+  try:
+    return np.datetime64(date, 'D')
+  except (ValueError, TypeError):
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+class TradingCalendar:
+  """
+  Sorted datetime64 array of the trading days of an exchange, built once and extended lazily a year at
+  a time when a later date is asked for. Range queries and previous/next lookups are binary searches,
+  ordinal lookups are O(1) once the calendar reaches the date.
+  Ordinals are positions in the array and never change since the calendar only grows forward from ORIGIN.
+  """
+
+  def __init__(self, exchange='NYSE'):
+    self.exchange = exchange
+    self.days = np.array([], dtype='datetime64[D]')
+    self._end = ORIGIN
+    self._ordinals = np.array([], dtype=np.int64)
+    self._lock = threading.Lock()
+
+  def _schedule(self, start : np.datetime64, end : np.datetime64) -> np.ndarray:
+    import pandas_market_calendars as mcal
+
+    schedule = mcal.get_calendar(self.exchange).schedule(start_date=str(start), end_date=str(end))
+    return schedule.index.values.astype('datetime64[D]')
+
+  def extend(self, date):
+    """
+    Make sure the calendar covers every day up to and including the given date.
+    """
+
+    day = _to_day(date)
+    if day < self._end:
+      return
+
+    with self._lock:
+      if day < self._end:
+        return
+
+      # Build through the end of the following year so consecutive days rarely trigger a rebuild
+      end = np.datetime64(str(day.astype('datetime64[Y]') + 2) + '-01-01', 'D')
+      days = np.concatenate([self.days, self._schedule(self._end, end - 1)])
+
+      # Position of every calendar day in the trading day array, -1 for non trading days
+      ordinals = np.full((end - ORIGIN).astype(int), -1, dtype=np.int64)
+      ordinals[(days - ORIGIN).astype(int)] = np.arange(len(days))
+
+      self.days, self._ordinals, self._end = days, ordinals, end
+
+  def _check(self, day : np.datetime64):
+    if day < ORIGIN:
+      raise ValueError('Dates before ' + str(ORIGIN) + ' are not covered by the trading calendar')
+    self.extend(day)
+
+  def trading_days(self, start_date, end_date) -> np.ndarray:
+    """
+    All trading days between start_date and end_date, both included.
+    """
+
+    start, end = _to_day(start_date), _to_day(end_date)
+    self._check(max(start, ORIGIN))
+    self._check(max(end, ORIGIN))
+
+    lo = np.searchsorted(self.days, start, 'left')
+    hi = np.searchsorted(self.days, end, 'right')
+    return self.days[lo:hi]
+
+  def is_trading_day(self, date) -> bool:
+    day = _to_day(date)
+    self._check(day)
+    return self._ordinals[(day - ORIGIN).astype(int)] >= 0
+
+  def ordinal(self, date) -> int:
+    """
+    Index of a trading day in the calendar. Raises KeyError for days the market was closed.
+    """
+
+    day = _to_day(date)
+    self._check(day)
+    ordinal = self._ordinals[(day - ORIGIN).astype(int)]
+    if ordinal < 0:
+      raise KeyError(str(day) + ' is not a trading day')
+    return int(ordinal)
+
+  def ordinals(self, dates) -> np.ndarray:
+    """
+    Vectorized ordinal lookup, -1 for days the market was closed.
+    """
+
+    days = np.asarray(dates, dtype='datetime64[D]')
+    if len(days) == 0:
+      return np.array([], dtype=np.int64)
+    self._check(days.min())
+    self._check(days.max())
+    return self._ordinals[(days - ORIGIN).astype(int)]
+
+  def previous(self, date) -> np.datetime64:
+    """
+    Last trading day strictly before the given date.
+    """
+
+    day = _to_day(date)
+    self._check(day)
+    i = np.searchsorted(self.days, day, 'left')
+    if i == 0:
+      raise KeyError('No trading day before ' + str(day))
+    return self.days[i - 1]
+
+  def on_or_before(self, date) -> np.datetime64:
+    """
+    The given date if the market was open, otherwise the last trading day before it.
+    """
+
+    day = _to_day(date)
+    self._check(day)
+    i = np.searchsorted(self.days, day, 'right')
+    if i == 0:
+      raise KeyError('No trading day on or before ' + str(day))
+    return self.days[i - 1]
+
+  def next(self, date) -> np.datetime64:
+    """
+    First trading day strictly after the given date.
+    """
+
+    day = _to_day(date)
+    self._check(day + 1)
+    i = np.searchsorted(self.days, day, 'right')
+    if i == len(self.days):
+      self.extend(self._end)
+    return self.days[i]
+
+
+class DaySet:
+  """
+  Set of trading days stored as a boolean array indexed by calendar ordinal, so membership tests
+  ('2020-11-06' in days) are O(1). Days the market was closed are never members.
+  """
+
+  def __init__(self, calendar : TradingCalendar, flags : np.ndarray, first_ordinal=0):
+    self.calendar = calendar
+    self.flags = flags
+    self.first_ordinal = first_ordinal
+
+  @classmethod
+  def from_dates(cls, calendar : TradingCalendar, dates):
+    """
+    Build the set from any sequence of dates, e.g. the index of the rows carrying a signal.
+    """
+
+    days = np.asarray(dates, dtype='datetime64[D]')
+    ordinals = calendar.ordinals(days[days >= ORIGIN])
+    ordinals = ordinals[ordinals >= 0]
+    if len(ordinals) == 0:
+      return cls(calendar, np.zeros(0, dtype=bool))
+
+    first = int(ordinals.min())
+    flags = np.zeros(int(ordinals.max()) - first + 1, dtype=bool)
+    flags[ordinals - first] = True
+    return cls(calendar, flags, first)
+
+  def __contains__(self, date) -> bool:
+    try:
+      i = self.calendar.ordinal(date) - self.first_ordinal
+    except (KeyError, ValueError):
+      return False
+    return 0 <= i < len(self.flags) and bool(self.flags[i])
+
+  def __len__(self) -> int:
+    return int(self.flags.sum())
+
+  def __iter__(self):
+    return iter(self.to_array())
+
+  def to_array(self) -> np.ndarray:
+    """
+    Member days as a sorted datetime64 array.
+    """
+    return self.calendar.days[self.first_ordinal + np.flatnonzero(self.flags)]
+
+
+_calendars = dict()
+_calendars_lock = threading.Lock()
+
+def get_calendar(exchange='NYSE') -> TradingCalendar:
+  """
+  Process wide calendar of an exchange, shared by the backtest and live trading paths.
+  """
+
+  with _calendars_lock:
+    if exchange not in _calendars:
+      _calendars[exchange] = TradingCalendar(exchange)
+    return _calendars[exchange]
@@ -0,0 +1,238 @@
+import os
+import json
+import contextlib
+import time
+import shutil
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import market_data
+import indicators
+import metrics
+
+# Columns of analysis.analyze_data
+ANALYSIS_COLUMNS = ['Trend', 'Final Lower Band', 'Final Upper Band', 'Close', 'MACD', 'Signal', 'Buy', 'Sell']
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.robotrader', 'trends')
+
+# Seconds between two eviction passes, each pass lists the whole cache directory
+EVICT_INTERVAL = 60
+
+
+def analyze(state : indicators.StrategyState, data : pd.DataFrame) -> pd.DataFrame:
+  """
+  Fold the bars of a frame into a strategy state and return their trend analysis, with the columns
+  of analysis.analyze_data. Starting from a fresh state this equals analyze_data(data), starting
+  from the state left by earlier bars it equals the rows analyze_data would give these bars
+  after them.
+  """
+
+  rows = [state.update(str(date), high, low, close)
+          for date, high, low, close in zip(data.index, data['High'].values, data['Low'].values, data['Close'].values)]
+  frame = pd.DataFrame(rows, index=data.index, columns=['Trend', 'Final Lower Band', 'Final Upper Band', 'MACD',
+                                                        'Signal', 'Buy', 'Sell'])
+  frame['Close'] = data['Close']
+  return frame[ANALYSIS_COLUMNS].astype({'Trend': bool, 'Buy': bool, 'Sell': bool})
+
+def fingerprint(data : pd.DataFrame) -> str:
+  """
+  Hash of the bars the strategy reads, so cached results are recomputed when history is revised.
+  """
+
+  digest = hashlib.blake2b(digest_size=16)
+  digest.update(data.index.values.astype('datetime64[ns]').tobytes())
+  for field in ('High', 'Low', 'Close'):
+    digest.update(np.ascontiguousarray(data[field].values, dtype=float).tobytes())
+  return digest.hexdigest()
+
+
+class TrendCache:
+  """
+  On-disk cache of the trend analysis of analysis.evaluate_trends. An entry holds the analysis of
+  a ticker from a start date on for one set of strategy parameters, the strategy state after its
+  last row and a fingerprint of the bars it was computed from. Once new bars arrive only those are
+  analysed, warm started from the stored state. If the stored bars changed, e.g. after a split
+  adjustment, the entry is computed again.
+  Entries that were not used for max_age seconds are evicted, as are the least recently used ones
+  once the cache grows beyond max_bytes.
+  """
+
+  def __init__(self, directory=None, max_bytes=None, max_age=None, params=indicators.STRATEGY_PARAMS):
+    self.directory = directory or os.environ.get('ROBOTRADER_TREND_CACHE_DIR', DEFAULT_CACHE_DIR)
+    self.max_bytes = max_bytes if max_bytes is not None \
+      else int(float(os.environ.get('ROBOTRADER_TREND_CACHE_MB', 512)) * 2**20)
+    self.max_age = max_age if max_age is not None else float(os.environ.get('ROBOTRADER_TREND_CACHE_DAYS', 30)) * 86400
+    self.params = params
+    self._last_evict = 0.0
+
+  def _path(self, ticker : str, start : pd.Timestamp) -> str:
+    key = hashlib.blake2b(repr((self.params, str(start.date()))).encode(), digest_size=8).hexdigest()
+    return os.path.join(self.directory, ticker.replace('/', '_'), key)
+
+  def load(self, ticker : str, start):
+    """
+    Return the cached (analysis, state, meta) of a ticker from start on, or None.
+    """
+
+    path = self._path(ticker, pd.Timestamp(start).normalize())
+    try:
+      with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+      with np.load(os.path.join(path, 'frame.npz')) as columns:
+        frame = pd.DataFrame({column: columns[column] for column in ANALYSIS_COLUMNS},
+                             index=pd.DatetimeIndex(columns['Date'], name='Date'))
+    except (OSError, ValueError, KeyError):
+      return None
+
+    # A partially replaced entry is a miss
+    if len(frame) != meta['rows']:
+      return None
+
+    # Reading counts as use for the age based eviction
+    os.utime(os.path.join(path, 'meta.json'))
+    return frame, indicators.StrategyState.from_dict(meta['state']), meta
+
+  def save(self, ticker : str, start, frame : pd.DataFrame, state : indicators.StrategyState, data_fingerprint : str):
+    path = self._path(ticker, pd.Timestamp(start).normalize())
+    os.makedirs(path, exist_ok=True)
+
+    # Write to temporary files first so readers never see a truncated entry, named per writer so
+    # concurrent writers of the same entry do not move each other's files
+    suffix = '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+    columns = {column: frame[column].values for column in ANALYSIS_COLUMNS}
+    columns['Date'] = frame.index.values
+    with open(os.path.join(path, 'frame.npz' + suffix), 'wb') as f:
+      np.savez(f, **columns)
+    os.replace(os.path.join(path, 'frame.npz' + suffix), os.path.join(path, 'frame.npz'))
+
+    meta = {'ticker': ticker, 'start': str(pd.Timestamp(start).date()), 'params': self.params, 'rows': len(frame),
+            'fingerprint': data_fingerprint, 'state': state.to_dict()}
+    with open(os.path.join(path, 'meta.json' + suffix), 'w') as f:
+      json.dump(meta, f)
+    os.replace(os.path.join(path, 'meta.json' + suffix), os.path.join(path, 'meta.json'))
+
+    if time.time() - self._last_evict > EVICT_INTERVAL:
+      self.evict()
+
+  @metrics.timed('trend_cache')
+  def trend_analysis(self, ticker : str, start, end=None) -> pd.DataFrame:
+    """
+    Trend analysis of the bars of a ticker in [start, end), equal to analysis.analyze_data on them.
+    Cached rows are reused as long as the bars they were computed from are unchanged, and only
+    bars after the last cached one are analysed.
+    """
+
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end) if end is not None else None
+    cached = self.load(ticker, start)
+
+    # Read at least up to the last cached bar so the whole entry can be checked
+    fetch_end = end
+    if cached is not None and end is not None and len(cached[0]) and cached[0].index[-1] >= end:
+      fetch_end = cached[0].index[-1] + pd.Timedelta(days=1)
+    data = market_data.get_history(ticker, start=start, end=fetch_end)
+
+    frame, state = None, None
+    if cached is not None:
+      rows = cached[2]['rows']
+      if len(data) >= rows and fingerprint(data.iloc[:rows]) == cached[2]['fingerprint']:
+        frame, state = cached[0], cached[1]
+        metrics.count('trend_cache_hits')
+
+    if frame is None:
+      metrics.count('trend_cache_misses')
+      frame, state = None, indicators.StrategyState(*self.params)
+      new = data
+    else:
+      new = data.iloc[len(frame):]
+
+    if frame is None or len(new):
+      appended = analyze(state, new)
+      frame = appended if frame is None else pd.concat([frame, appended])
+      # Tickers without any bars are not worth an entry. The analysis is complete without one, so
+      # a failed save, e.g. an entry evicted by another process meanwhile, only costs the reuse
+      if len(frame):
+        try:
+          self.save(ticker, start, frame, state, fingerprint(data))
+        except OSError:
+          metrics.count('trend_cache_save_errors')
+
+    if end is not None:
+      frame = frame.iloc[:frame.index.searchsorted(end, 'left')]
+    return frame
+
+  def entries(self) -> list[tuple[str, float, int]]:
+    """
+    Every cache entry as (path, last use, size in bytes).
+    """
+
+    found = []
+    if not os.path.isdir(self.directory):
+      return found
+    for ticker in os.listdir(self.directory):
+      ticker_path = os.path.join(self.directory, ticker)
+      if not os.path.isdir(ticker_path):
+        continue
+      for key in os.listdir(ticker_path):
+        path = os.path.join(ticker_path, key)
+        try:
+          used = os.path.getmtime(os.path.join(path, 'meta.json'))
+          size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        except OSError:
+          continue
+        found.append((path, used, size))
+    return found
+
+  def evict(self):
+    """
+    Drop entries unused for longer than max_age, then the least recently used ones until the cache
+    fits into max_bytes.
+    """
+
+    now = self._last_evict = time.time()
+    entries = sorted(self.entries(), key=lambda entry: entry[1])
+    total = sum(size for path, used, size in entries)
+
+    for path, used, size in entries:
+      if now - used <= self.max_age and total <= self.max_bytes:
+        break
+      shutil.rmtree(path, ignore_errors=True)
+      total -= size
+
+  def clear(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+
+_trend_cache = None
+
+def get_trend_cache() -> TrendCache:
+  """
+  Process wide trend cache, configured by ROBOTRADER_TREND_CACHE_DIR, ROBOTRADER_TREND_CACHE_MB and
+  ROBOTRADER_TREND_CACHE_DAYS. Set ROBOTRADER_TREND_CACHE=0 to disable it.
+  """
+
+  global _trend_cache
+  if _trend_cache is None:
+    _trend_cache = TrendCache()
+  return _trend_cache
+
+def enabled() -> bool:
+  return os.environ.get('ROBOTRADER_TREND_CACHE', '1') != '0'
+
+@contextlib.contextmanager
+def disabled():
+  """
+  Turn the trend cache off within the block, in this process and in worker processes started in it,
+  e.g. to time the computation it saves.
+  """
+
+  previous = os.environ.get('ROBOTRADER_TREND_CACHE')
+  os.environ['ROBOTRADER_TREND_CACHE'] = '0'
+  try:
+    yield
+  finally:
+    if previous is None:
+      del os.environ['ROBOTRADER_TREND_CACHE']
+    else:
+      os.environ['ROBOTRADER_TREND_CACHE'] = previous
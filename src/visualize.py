@@ -0,0 +1,50 @@
+import pandas as pd
+
+# Plots of the analysis results. matplotlib is only imported once something is actually drawn,
+# so importing the analysis modules (and the API) does not pay for it.
+
+
+def _pyplot():
+  import matplotlib.pyplot as plt
+  return plt
+
+def plot_volatility(ticker : str, log_return : pd.Series, volatility : float):
+  """
+  Histogram of the daily log returns of a stock, titled with its annualized volatility.
+  """
+
+  plt = _pyplot()
+  str_vol = str(round(volatility, 4))
+
+  fig, ax = plt.subplots()
+  log_return.hist(ax=ax, bins=50, alpha=0.6, color='b')
+  ax.set_xlabel("Log return")
+  ax.set_ylabel("Freq of log return")
+  ax.set_title(ticker + " Volatility: " + str_vol + "%")
+
+  plt.show()
+
+def plot_supertrend(data : pd.DataFrame, final_trend : pd.DataFrame):
+  """
+  Closing prices with the final lower and upper bands of the adjusted supertrend.
+  """
+
+  plt = _pyplot()
+
+  plt.plot(data['Close'], label='Close Price')
+  plt.plot(final_trend['Final Lower Band'], 'g', label = 'Final Lowerband ')
+  plt.plot(final_trend['Final Upper Band'], 'r', label = 'Final Upperband ')
+
+  plt.show()
+
+def plot_macd(MACD_line : pd.Series, signal_line : pd.Series):
+  """
+  MACD and signal lines around the zero line.
+  """
+
+  plt = _pyplot()
+
+  plt.plot(MACD_line, 'g', label = 'MACD Line')
+  plt.plot(signal_line, 'r', label = 'Signal Line')
+  plt.axhline(0)
+  plt.show()